@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# Times each stage of the pipeline against synthetic data and writes the results as JSON so runs can be compared
+import argparse
+import glob
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+from datetime import datetime
+
+from budget_parser import BudgetTimeline, parse_monthly_statement_date
+from calculator import compute_carry, compute_remainder, compute_remaining_spend, \
+    compute_next_month_available_budget
+from ledger import compute_months
+from renderer import prepare_report_rows, render_csv, render_html
+from statement_ingestion import group_statements_by_month, parse_monthly_views
+from synthetic_data import generate_dataset
+from file_paths import EXPENSES_STATEMENT_PRE_CATEGORISE_DIR, EXPENSES_STATEMENT_POST_CATEGORISE_DIR, \
+    EXPENSES_STATEMENT_CSV_PATTERN
+
+
+def timed(stages: dict, name: str, function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    stages[name] = time.perf_counter() - start
+    return result
+
+
+def compute_months_iteratively(parsed_budgets: list[dict], parsed_statements: list[dict]) -> list[tuple]:
+    months = []
+    remainder = None
+    for parsed_budget, parsed_statement in zip(parsed_budgets, parsed_statements):
+        carry = compute_carry(remainder, parsed_budget)
+        remainder = compute_remainder(carry, parsed_budget, parsed_statement)
+        months.append((carry, remainder, compute_remaining_spend(carry, parsed_budget),
+                       compute_next_month_available_budget(remainder, parsed_budget)))
+    return months
+
+
+def benchmark_categorisation(directory: str, dataset: dict, latency: float, max_concurrency: int) -> float:
+    # categorises into an empty post-categorise directory so every row goes to the fake endpoint
+    import openai
+    import fake_completion_server
+    import gpt_categoriser
+
+    categorise_directory = os.path.join(directory, "categorise")
+    os.makedirs(os.path.join(categorise_directory, EXPENSES_STATEMENT_POST_CATEGORISE_DIR))
+    shutil.copytree(os.path.join(directory, EXPENSES_STATEMENT_PRE_CATEGORISE_DIR),
+                    os.path.join(categorise_directory, EXPENSES_STATEMENT_PRE_CATEGORISE_DIR))
+    for budget in dataset["budgets"]:
+        shutil.copy(budget, categorise_directory)
+
+    server = fake_completion_server.start_server(latency=latency)
+    openai.api_base = "http://127.0.0.1:{}/v1".format(server.server_address[1])
+    openai.api_key = openai.api_key or "fake"
+    working_directory = os.getcwd()
+    os.chdir(categorise_directory)
+    try:
+        budget_timeline = BudgetTimeline(glob.glob("monthly_budget*.csv"))
+        statements = sorted(glob.glob(EXPENSES_STATEMENT_PRE_CATEGORISE_DIR + EXPENSES_STATEMENT_CSV_PATTERN))
+        start = time.perf_counter()
+        gpt_categoriser.categorise_statements(budget_timeline, statements, max_concurrency)
+        return time.perf_counter() - start
+    finally:
+        os.chdir(working_directory)
+        server.shutdown()
+
+
+def run_benchmark(directory: str, months: int, categories: int, sub_categories: int, transactions: int,
+                  accounts: int, categorise: bool, latency: float, max_concurrency: int, workers: int) -> dict:
+    stages = {}
+    dataset = timed(stages, "generate_dataset", generate_dataset, directory, months, categories, sub_categories,
+                    transactions, accounts)
+    monthly_statements = group_statements_by_month(dataset["post_categorise_statements"])
+    statements = [month_statements[0] for month_statements in monthly_statements.values()]
+
+    budget_timeline = BudgetTimeline(dataset["budgets"])
+    parsed_budgets = timed(stages, "parse_budgets", lambda: [budget_timeline.parsed_budget(statement).as_dict()
+                                                             for statement in statements])
+    timed(stages, "parse_monthly_views", parse_monthly_views, monthly_statements, 1)
+    monthly_views = timed(stages, "parse_monthly_views_parallel", parse_monthly_views, monthly_statements, workers)
+    parsed_statements = list(monthly_views.values())
+    timed(stages, "calculator_iterative", compute_months_iteratively, parsed_budgets, parsed_statements)
+    computed_months = timed(stages, "calculator_ledger", compute_months, parsed_budgets, parsed_statements)
+    monthly_report_rows = timed(stages, "prepare_report_rows", lambda: [
+        prepare_report_rows(parsed_budget, parsed_statement, *computed_month)
+        for parsed_budget, parsed_statement, computed_month in zip(parsed_budgets, parsed_statements,
+                                                                   computed_months)])
+
+    output_dir = os.path.join(directory, "reports")
+    os.makedirs(output_dir)
+    statement_dates = list(map(parse_monthly_statement_date, statements))
+    timed(stages, "render_csv", lambda: [render_csv(report_rows, statement_date, output_dir)
+                                         for report_rows, statement_date in zip(monthly_report_rows,
+                                                                                statement_dates)])
+    timed(stages, "render_html", lambda: [render_html(report_rows, statement_date, output_dir)
+                                          for report_rows, statement_date in zip(monthly_report_rows,
+                                                                                 statement_dates)])
+    if categorise:
+        stages["categorise_statements"] = benchmark_categorisation(directory, dataset, latency, max_concurrency)
+    return stages
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark each pipeline stage against synthetic data")
+    parser.add_argument("--months", type=int, default=24)
+    parser.add_argument("--categories", type=int, default=10)
+    parser.add_argument("--sub-categories", type=int, default=4, help="sub-categories per category")
+    parser.add_argument("--transactions", type=int, default=200, help="transactions per month")
+    parser.add_argument("--accounts", type=int, default=1, help="statements per month")
+    parser.add_argument("--workers", type=int, default=None, help="processes used to parse statements in parallel")
+    parser.add_argument("--categorise", action="store_true", help="also time categorisation against a fake endpoint")
+    parser.add_argument("--latency", type=float, default=0.5, help="fake completion endpoint latency in seconds")
+    parser.add_argument("--max-concurrency", type=int, default=4)
+    parser.add_argument("--label", default="", help="free text stored with the results, e.g. a version")
+    parser.add_argument("--output", default="benchmark_results.json")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        stages = run_benchmark(directory, args.months, args.categories, args.sub_categories, args.transactions,
+                               args.accounts, args.categorise, args.latency, args.max_concurrency, args.workers)
+    results = {
+        "label": args.label,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "parameters": {
+            "months": args.months,
+            "categories": args.categories,
+            "sub_categories": args.sub_categories,
+            "transactions": args.transactions,
+            "accounts": args.accounts,
+            "workers": args.workers,
+            "latency": args.latency if args.categorise else None,
+            "max_concurrency": args.max_concurrency if args.categorise else None
+        },
+        "stages": stages
+    }
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+    for name, seconds in stages.items():
+        print("{:<28}{:>10.4f}s".format(name, seconds))
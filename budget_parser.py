@@ -1,92 +1,229 @@
+import bisect
 import csv
+import hashlib
+import os
 import re
 from dateutil.relativedelta import relativedelta
 from stockholm import Money
 from datetime import datetime
 
+from ledger import money_to_cents, cents_to_money
+from metrics import metrics
+
+AMOUNT_STRIP_TABLE: dict = str.maketrans("", "", "$,")
+EXPORT_DATE_FORMAT: str = "%d/%m/%Y"  # Date column of multi-month statement exports
+STATEMENT_NAME_PATTERN: re.Pattern = re.compile("^SpendAccount(.*?)[-_]?([0-9]{4}-[0-9]{2})\\.csv$")
+
+
+class ParsedBudget:
+    # Single parsed representation of a budget file, the calculator dict, category pairs and GPT prompt text are
+    # all derived from these rows
+    def __init__(self, budget: str):
+        with open(budget, "rb") as file:
+            contents = file.read()
+        self.budget = budget
+        self.digest = hashlib.sha256(contents).hexdigest()
+        rows = list(csv.reader(contents.decode().splitlines()))
+        self.header_row = rows[0]
+        self.rows = rows[1:]
+        self.category_index = self.header_row.index("Category")
+        self.sub_category_index = self.header_row.index("Sub-Category")
+        self.budget_index = self.header_row.index("Budget")
+        self.ignore_index = self.header_row.index("Ignore")
+        self.parsed_budget = None
+        self.categories = None
+
+    def included_rows(self) -> list[list[str]]:
+        return [row for row in self.rows if row[self.ignore_index] != "1"]
+
+    def as_dict(self) -> dict:
+        if self.parsed_budget is None:
+            parsed_budget = {}
+            for row in self.rows:
+                category = row[self.category_index]
+                sub_category = row[self.sub_category_index]
+                if category not in parsed_budget:
+                    parsed_budget[category] = {}
+                if row[self.ignore_index] != "1":
+                    parsed_budget[category][sub_category] = Money(int(row[self.budget_index]), "AUD")
+            self.parsed_budget = parsed_budget
+        return self.parsed_budget
+
+    def category_pairs(self) -> set[tuple[str, str]]:
+        if self.categories is None:
+            self.categories = set(map(lambda row: (row[self.category_index], row[self.sub_category_index]),
+                                      self.included_rows()))
+        return self.categories
+
+
+parsed_budget_cache: dict[str, tuple[tuple[int, int], ParsedBudget]] = {}
+
+
+def load_budget(budget: str) -> ParsedBudget:
+    # memoised per file, a changed modification time or size re-reads it
+    stat = os.stat(budget)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    cached = parsed_budget_cache.get(budget)
+    if cached is None or cached[0] != signature:
+        cached = parsed_budget_cache[budget] = (signature, ParsedBudget(budget))
+    return cached[1]
+
+
+class BudgetTimeline:
+    # Budgets sorted by date once per run, the effective budget of a statement is the latest budget dated before
+    # the end of the statement's month
+    def __init__(self, monthly_budgets: list[str]):
+        dated_budgets = sorted(map(lambda budget: (parse_monthly_budget_date(budget), budget), monthly_budgets))
+        self.dates = [date for date, _ in dated_budgets]
+        self.budgets = [budget for _, budget in dated_budgets]
+
+    def effective_budget(self, statement: str) -> str:
+        return self.effective_budget_on(parse_monthly_statement_date(statement), statement)
+
+    def effective_budget_on(self, statement_date: datetime, source: str = None) -> str:
+        # statement_date is the last day of the month being reported, source names it in the error
+        position = bisect.bisect_left(self.dates, statement_date) - 1
+        if position < 0:
+            raise Exception("No valid budget found for provided statement: {}!"
+                            .format(source or statement_date.strftime("%Y-%m")))
+        return self.budgets[position]
+
+    def parsed_budget(self, statement: str) -> ParsedBudget:
+        return load_budget(self.effective_budget(statement))
+
+    def parsed_budget_on(self, statement_date: datetime) -> ParsedBudget:
+        return load_budget(self.effective_budget_on(statement_date))
+
 
 def find_latest_valid_budget(monthly_budgets: list[str], statement: str) -> str:
-    statement_date = parse_monthly_statement_date(statement)
-    latest_valid_budget = None
-    for budget in sorted(monthly_budgets):
-        monthly_budget_date = parse_monthly_budget_date(budget)
-        if monthly_budget_date < statement_date:
-            latest_valid_budget = budget
-    if latest_valid_budget is None:
-        raise Exception("No valid budget found for provided statement: {}!".format(statement))
-    return latest_valid_budget
+    return BudgetTimeline(monthly_budgets).effective_budget(statement)
 
 
 def parse_latest_valid_budget(monthly_budgets: list[str], statement: str) -> dict:
-    latest_valid_budget = find_latest_valid_budget(monthly_budgets, statement)
-    parsed_budget = {}
-    with open(latest_valid_budget) as file:
-        reader = csv.reader(file)
-        header_row = True
+    return load_budget(find_latest_valid_budget(monthly_budgets, statement)).as_dict()
+
+
+def parse_amount_cents(amount: str) -> int:
+    # statements are totalled in whole cents, an amount with fractions of a cent (e.g. $12.345) is rejected rather
+    # than rounded since it can only come from a malformed statement
+    normalised = amount.translate(AMOUNT_STRIP_TABLE)
+    if normalised == "" or normalised == "-":
+        return None
+    negative = normalised[0] == "-"
+    whole, _, fraction = normalised.lstrip("-").partition(".")
+    if whole.isdecimal() and len(fraction) <= 2 and (fraction == "" or fraction.isdecimal()):
+        cents = int(whole) * 100 + int(fraction.ljust(2, "0"))
+        return -cents if negative else cents
+    return money_to_cents(Money(normalised, "AUD"))
+
+
+def statement_column_indices(header_row: list[str]) -> tuple[int, int, int, int]:
+    return header_row.index("Debit"), header_row.index("Credit"), header_row.index("Category"), \
+        header_row.index("Sub-Category")
+
+
+def statement_row_amount(row: list[str], column_indices: tuple[int, int, int, int]) -> tuple[str, str, int]:
+    # the (category, sub_category, cents) a row adds to the report, None for rows the report does not count
+    debit_index, credit_index, category_index, sub_category_index = column_indices
+    debit_cents = parse_amount_cents(row[debit_index])
+    category = row[category_index]
+    sub_category = row[sub_category_index]
+    category_exists = category != "" and category != "-"
+    sub_category_exists = sub_category != "" and sub_category != "-"
+    if debit_cents is None:
+        credit_cents = parse_amount_cents(row[credit_index])
+        if credit_cents is None or not category_exists or not sub_category_exists:
+            return None
+        applied_cents = -credit_cents
+    else:
+        applied_cents = debit_cents
+    category_name = category if category_exists else "Uncategorised"
+    sub_category_name = sub_category if sub_category_exists else "Uncategorised"
+    return category_name, sub_category_name, applied_cents
+
+
+def aggregate_statement_row(row: list[str], column_indices: tuple[int, int, int, int], totals: dict) -> None:
+    # adds the row's amount in cents to totals[category][sub_category], skipping rows the report does not count
+    amount = statement_row_amount(row, column_indices)
+    if amount is None:
+        return
+    category_name, sub_category_name, applied_cents = amount
+
+    category_totals = totals.get(category_name)
+    if category_totals is None:
+        category_totals = totals[category_name] = {}
+    category_totals[sub_category_name] = category_totals.get(sub_category_name, 0) + applied_cents
+
+
+def cents_to_money_totals(totals: dict) -> dict:
+    parsed_statement = {}
+    for category in totals:
+        parsed_statement[category] = {}
+        for sub_category in totals[category]:
+            parsed_statement[category][sub_category] = cents_to_money(totals[category][sub_category])
+    return parsed_statement
 
+
+def parse_statement_totals(statement: str) -> tuple[dict, int]:
+    # totals in cents and the number of rows read, cents and plain dicts keep results cheap to send between processes
+    totals = {}
+    with open(statement) as file:
+        reader = csv.reader(file)
+        column_indices = statement_column_indices(next(reader))
         for row in reader:
-            if header_row:
-                category_index = row.index("Category")
-                sub_category_index = row.index("Sub-Category")
-                budget_index = row.index("Budget")
-                ignore_index = row.index("Ignore")
-                header_row = False
-            else:
-                category = row[category_index]
-                sub_category = row[sub_category_index]
-                if category not in parsed_budget:
-                    parsed_budget[category] = {}
-                if row[ignore_index] != "1":
-                    parsed_budget[category][sub_category] = Money(int(row[budget_index]), "AUD")
-    return parsed_budget
+            aggregate_statement_row(row, column_indices, totals)
+        return totals, reader.line_num - 1
 
 
 def parse_monthly_statement(statement: str) -> dict:
-    parsed_statement = {}
-    with open(statement) as file:
-        reader = csv.reader(file)
-        header_row = True
+    totals, rows_parsed = parse_statement_totals(statement)
+    metrics.increment("rows_parsed", rows_parsed)
+    return cents_to_money_totals(totals)
 
-        for row in reader:
-            if header_row:
-                debit_index = row.index("Debit")
-                credit_index = row.index("Credit")
-                category_index = row.index("Category")
-                sub_category_index = row.index("Sub-Category")
-                header_row = False
-            else:
-                normalised_debit = row[debit_index].replace("$", "").replace(",", "")
-                normalised_credit = row[credit_index].replace("$", "").replace(",", "")
-                missing_debit = normalised_debit == "" or normalised_debit == "-"
-                missing_credit = normalised_credit == "" or normalised_credit == "-"
-                category_exists = row[category_index] != "" and row[category_index] != "-"
-                sub_category_exists = row[sub_category_index] != "" and row[sub_category_index] != "-"
-                credit_with_category = not missing_credit and category_exists and sub_category_exists
-
-                if missing_debit and not credit_with_category:
-                    continue
-
-                parsed_debit_amount = None if missing_debit else Money(normalised_debit, "AUD")
-                parsed_credit_amount: Money = None if missing_credit else -Money(normalised_credit, "AUD")
-                applied_amount = parsed_debit_amount if parsed_debit_amount is not None else parsed_credit_amount
-                category_name = "Uncategorised" if not category_exists else row[category_index]
-                sub_category_name = "Uncategorised" if not sub_category_exists else row[sub_category_index]
-
-                if category_name not in parsed_statement:
-                    parsed_statement[category_name] = {}
-                    parsed_statement[category_name][sub_category_name] = applied_amount
-                elif sub_category_name not in parsed_statement[category_name]:
-                    parsed_statement[category_name][sub_category_name] = applied_amount
-                else:
-                    current_total: Money = parsed_statement[category_name][sub_category_name]
-                    parsed_statement[category_name][sub_category_name] = current_total + applied_amount
 
-    return parsed_statement
+def parse_statement_export(export_file: str, date_format: str = EXPORT_DATE_FORMAT) -> dict[str, dict]:
+    # Streams a multi-month export row by row, splitting on the Date column, and returns per-month totals in
+    # cents keyed by "YYYY-MM" in chronological order, only the totals are ever held in memory
+    monthly_totals = {}
+    month_by_date = {}
+    with open(export_file, newline="") as file:
+        reader = csv.reader(file)
+        header_row = next(reader)
+        date_index = header_row.index("Date")
+        column_indices = statement_column_indices(header_row)
+        for row in reader:
+            date = row[date_index]
+            month = month_by_date.get(date)
+            if month is None:
+                month = month_by_date[date] = datetime.strptime(date, date_format).strftime("%Y-%m")
+            totals = monthly_totals.get(month)
+            if totals is None:
+                totals = monthly_totals[month] = {}
+            aggregate_statement_row(row, column_indices, totals)
+        metrics.increment("rows_parsed", reader.line_num - 1)
+    return {month: monthly_totals[month] for month in sorted(monthly_totals)}
+
+
+def statement_name_match(statement: str) -> re.Match:
+    # the month is the last part of the name so digits in the account (e.g. SpendAccount1234-2023-02.csv) are not
+    # mistaken for it, the account is optional and may be separated from the month by "_" or "-"
+    match = STATEMENT_NAME_PATTERN.search(os.path.basename(statement))
+    if match is None:
+        raise Exception("Statement {} is not named SpendAccount<account>_YYYY-MM.csv!".format(statement))
+    return match
 
 
 def parse_monthly_statement_date(statement: str) -> datetime:
-    statement_date_str = re.search("([0-9]{4}-[0-9]{2})", statement).group(0)
-    return datetime.strptime(statement_date_str, "%Y-%m") + relativedelta(months=1) - relativedelta(days=1)
+    return month_end_date(statement_name_match(statement).group(2))
+
+
+def month_end_date(month: str) -> datetime:
+    # the date a "YYYY-MM" month is reported on, its last day
+    return datetime.strptime(month, "%Y-%m") + relativedelta(months=1) - relativedelta(days=1)
+
+
+def parse_statement_account(statement: str) -> str:
+    return statement_name_match(statement).group(1)
 
 
 def parse_monthly_budget_date(budget: str) -> datetime:
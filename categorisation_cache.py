@@ -0,0 +1,107 @@
+import csv
+import json
+import os
+import re
+
+from budget_parser import parse_monthly_budget_date
+
+# whole month names or their abbreviations only, so words such as MARKET or DECOR are kept
+MONTHS_PATTERN: str = "JAN(?:UARY)?|FEB(?:RUARY)?|MAR(?:CH)?|APR(?:IL)?|MAY|JUNE?|JULY?|AUG(?:UST)?|" \
+                      "SEPT?(?:EMBER)?|OCT(?:OBER)?|NOV(?:EMBER)?|DEC(?:EMBER)?"
+
+# applied in order to an upper-cased description, each match is removed
+DESCRIPTION_NOISE_PATTERNS: list[re.Pattern] = [
+    # card numbers, including masked ones such as XXXX1234 or 4564 **** **** 1234
+    re.compile(r"\bCARD\s*(?:NO\.?|NUMBER)?\s*[X*\d][X*\d -]*"),
+    re.compile(r"[X*]{4,}[X*\d -]*"),
+    re.compile(r"\b(?:\d[ -]?){12,19}\b"),
+    # dates and times
+    re.compile(r"\b\d{4}-\d{2}-\d{2}\b"),
+    re.compile(r"\b\d{1,2}[/.-]\d{1,2}(?:[/.-]\d{2,4})?\b"),
+    re.compile(r"\b\d{1,2}\s?(?:" + MONTHS_PATTERN + r")(?:\s?\d{2,4})?\b"),
+    re.compile(r"\b\d{1,2}:\d{2}(?::\d{2})?\b"),
+    # reference and receipt identifiers
+    re.compile(r"\b(?:REF|REFERENCE|RECEIPT|RCPT|TXN|TRANS|INV|ID)\b\s*(?:NO\.?)?\s*[:#.]?\s*[A-Z\d-]*\d[A-Z\d-]*"),
+    # identifiers need at least three digits so names such as B2B4YOU are kept
+    re.compile(r"\b(?=(?:[A-Z]*\d){3})[A-Z\d]{6,}\b"),
+    re.compile(r"\b\d{3,}\b"),
+]
+NON_WORD_PATTERN: re.Pattern = re.compile(r"[^A-Z0-9&]+")
+
+
+def normalise_description(description: str) -> str:
+    normalised = description.upper()
+    for pattern in DESCRIPTION_NOISE_PATTERNS:
+        normalised = pattern.sub(" ", normalised)
+    return NON_WORD_PATTERN.sub(" ", normalised).strip()
+
+
+class CategorisationCache:
+    # Maps normalised transaction descriptions to a (Category, Sub-Category) pair
+    # The cache is versioned by the newest budget it has been used with, when a newer budget is seen any entry
+    # whose pair no longer exists in that budget is evicted. Lookups also validate against the effective budget of
+    # the statement so older budgets never receive categories they do not define
+    def __init__(self, cache_file: str):
+        self.cache_file = cache_file
+        self.budget = None
+        self.seeded_files = {}
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        if os.path.exists(cache_file):
+            with open(cache_file) as file:
+                stored = json.load(file)
+            self.budget = stored["budget"]
+            self.seeded_files = stored["seeded_files"]
+            self.entries = {description: tuple(pair) for description, pair in stored["entries"].items()}
+
+    def save(self) -> None:
+        stored = {
+            "budget": self.budget,
+            "seeded_files": self.seeded_files,
+            "entries": {description: list(pair) for description, pair in self.entries.items()}
+        }
+        temporary_file = self.cache_file + ".tmp"
+        with open(temporary_file, "w") as file:
+            json.dump(stored, file)
+        os.replace(temporary_file, self.cache_file)
+
+    def seed(self, categorised_statements: list[str]) -> None:
+        for statement in sorted(categorised_statements):
+            modified_time = os.path.getmtime(statement)
+            if self.seeded_files.get(statement) == modified_time:
+                continue
+            with open(statement) as file:
+                reader = csv.reader(file)
+                header_row = True
+                for row in reader:
+                    if header_row:
+                        description_index = row.index("Description")
+                        category_index = row.index("Category")
+                        sub_category_index = row.index("Sub-Category")
+                        header_row = False
+                    else:
+                        self.add(row[description_index], row[category_index], row[sub_category_index])
+            self.seeded_files[statement] = modified_time
+
+    def use_budget(self, budget: str, budget_categories: set[tuple[str, str]]) -> None:
+        if self.budget is not None and parse_monthly_budget_date(budget) <= parse_monthly_budget_date(self.budget):
+            return
+        self.budget = budget
+        self.entries = {description: pair for description, pair in self.entries.items()
+                        if pair in budget_categories}
+
+    def lookup(self, description: str, budget_categories: set[tuple[str, str]]) -> tuple[str, str]:
+        pair = self.entries.get(normalise_description(description))
+        if pair is None or pair not in budget_categories:
+            self.misses = self.misses + 1
+            return None
+        self.hits = self.hits + 1
+        return pair
+
+    def add(self, description: str, category: str, sub_category: str) -> None:
+        if category in ("", "-", "Uncategorised") or sub_category in ("", "-", "Uncategorised"):
+            return
+        normalised_description = normalise_description(description)
+        if normalised_description != "":
+            self.entries[normalised_description] = (category, sub_category)
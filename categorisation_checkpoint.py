@@ -0,0 +1,50 @@
+import json
+import os
+
+from report_checkpoints import file_digest
+
+
+class CategorisationCheckpoint:
+    # Append-only JSON lines of every row categorised by the API, written as each response is validated so an
+    # interrupted run only re-requests the rows it had not received yet. Rows are keyed by the statement's digest
+    # so an edited statement starts again
+    def __init__(self, checkpoint_file: str):
+        self.checkpoint_file = checkpoint_file
+        self.resolved_rows = {}
+        self.file = None
+        if os.path.exists(checkpoint_file):
+            with open(checkpoint_file) as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # a line cut short by the interruption
+                    self.resolved_rows.setdefault(entry["digest"], {})[entry["row"]] = \
+                        (entry["category"], entry["sub_category"])
+
+    def resolved(self, statement_file: str) -> dict[int, tuple[str, str]]:
+        return self.resolved_rows.setdefault(file_digest(statement_file), {})
+
+    def append(self, statement_file: str, position: int, pair: tuple[str, str]) -> None:
+        digest = file_digest(statement_file)
+        self.resolved_rows.setdefault(digest, {})[position] = pair
+        if self.file is None:
+            self.file = open(self.checkpoint_file, "a")
+        self.file.write(json.dumps({"digest": digest, "row": position, "category": pair[0],
+                                    "sub_category": pair[1]}) + "\n")
+
+    def flush(self) -> None:
+        if self.file is not None:
+            self.file.flush()
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def remove(self) -> None:
+        # once every statement is committed the checkpoint has nothing left to resume
+        self.close()
+        self.resolved_rows = {}
+        if os.path.exists(self.checkpoint_file):
+            os.remove(self.checkpoint_file)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# Local stand-in for the OpenAI completions endpoint so categorisation can be exercised without an API key
+# Point the client at it with: OPENAI_API_BASE=http://localhost:8080/v1 OPENAI_API_KEY=fake
+import argparse
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def fake_completion_text(prompt: str, corrupt_rows=None) -> str:
+    # answers every row with the first budget row, echoing it in full or as Row,Id for compact prompts
+    # corrupt_rows is an iterator of booleans, rows it flags are answered with a category missing from the budget
+    lines = prompt.split("\n")
+    compact = any(line.startswith("Id,Category,") for line in lines)
+    budget_header_index = next(index for index, line in enumerate(lines)
+                               if line.startswith("Id,Category," if compact else "Category,"))
+    category_columns = lines[budget_header_index + 1].split(",")[:1 if compact else 2]
+    statement_header_index = next(index for index, line in enumerate(lines)
+                                  if line.startswith("Row,Description," if compact else "Description,"))
+    statement_rows = filter(lambda line: len(line) != 0, lines[statement_header_index + 1:])
+    response_rows = []
+    for row in statement_rows:
+        echoed_columns = [row.split(",")[0]] if compact else [row]
+        if corrupt_rows is not None and next(corrupt_rows):
+            response_rows.append(",".join(echoed_columns + (["0"] if compact else ["Not A Category", "-"])))
+        else:
+            response_rows.append(",".join(echoed_columns + category_columns))
+    return "\n".join(response_rows)
+
+
+def fake_completion_response(prompt: str, model: str, corrupt_rows=None) -> dict:
+    text = fake_completion_text(prompt, corrupt_rows)
+    # whitespace separated words are close enough to tokens for exercising usage reporting
+    prompt_tokens = len(prompt.split())
+    completion_tokens = len(text.split())
+    return {
+        "id": "cmpl-fake",
+        "object": "text_completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"text": text, "index": 0, "logprobs": None, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                  "total_tokens": prompt_tokens + completion_tokens}
+    }
+
+
+def make_handler(latency: float, rate_limit_every: int, corrupt_every: int = 0, fail_every: int = 0):
+    request_counter = itertools.count(1)
+    row_counter = itertools.count(1)
+    counter_lock = threading.Lock()
+
+    def corrupt_rows():
+        while True:
+            with counter_lock:
+                row_number = next(row_counter)
+            yield corrupt_every > 0 and row_number % corrupt_every == 0
+
+    class FakeCompletionHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            with counter_lock:
+                request_number = next(request_counter)
+            time.sleep(latency)
+            if rate_limit_every > 0 and request_number % rate_limit_every == 0:
+                self.send_json(429, {"error": {"message": "Rate limit reached", "type": "requests"}},
+                               {"Retry-After": "1"})
+                return
+            if fail_every > 0 and request_number % fail_every == 0:
+                self.send_json(500, {"error": {"message": "The server had an error", "type": "server_error"}}, {})
+                return
+            self.send_json(200, fake_completion_response(body["prompt"], body.get("model", "fake"), corrupt_rows()),
+                           {})
+
+        def send_json(self, status: int, payload: dict, headers: dict) -> None:
+            encoded = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(encoded)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(encoded)
+
+        def log_message(self, format, *args):
+            pass
+
+    return FakeCompletionHandler
+
+
+def start_server(port: int = 0, latency: float = 0, rate_limit_every: int = 0, corrupt_every: int = 0,
+                 fail_every: int = 0) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(latency, rate_limit_every, corrupt_every,
+                                                                   fail_every))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the OpenAI completions endpoint")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds to wait before each response")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="respond 429 to every nth request")
+    parser.add_argument("--corrupt-every", type=int, default=0, help="answer every nth row with an invalid category")
+    parser.add_argument("--fail-every", type=int, default=0, help="respond 500 to every nth request")
+    args = parser.parse_args()
+    ThreadingHTTPServer(("127.0.0.1", args.port),
+                        make_handler(args.latency, args.rate_limit_every, args.corrupt_every,
+                                     args.fail_every)).serve_forever()
@@ -1,5 +1,17 @@
+import os
+
 MONTHLY_BUDGET_CSV_PATTERN: str = "monthly_budget[0-9]*.csv"
 EXPENSES_STATEMENT_CSV_PATTERN: str = "SpendAccount[a-zA-Z0-9-]*[0-9]*-[0-9]*.csv"
 MONTHLY_BUDGET_DIR: str = "./"
 EXPENSES_STATEMENT_PRE_CATEGORISE_DIR: str = "./pre-categorise/"
 EXPENSES_STATEMENT_POST_CATEGORISE_DIR: str = "./post-categorise/"
+CATEGORISATION_CACHE_FILE: str = "./categorisation_cache.json"
+LOCAL_CLASSIFIER_FILE: str = "./local_classifier.json"
+CATEGORISATION_CHECKPOINT_FILE: str = "./categorisation_checkpoint.jsonl"
+REPORT_CHECKPOINT_FILE: str = "./report_checkpoints.json"
+IRREGULAR_CATEGORIES_FILE: str = "./irregular_categories.csv"
+TRANSACTION_DATABASE_FILE: str = "./transactions.sqlite3"
+REPORT_OUTPUT_DIR: str = "./"
+REPORT_FILENAME_FORMAT: str = "report{date}.{extension}"
+REPORT_TEMPLATE_FILE: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "report_template.mako")
+REPORT_TEMPLATE_MODULE_DIR: str = os.getenv("REPORT_TEMPLATE_MODULE_DIR")
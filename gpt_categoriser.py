@@ -1,20 +1,35 @@
+import asyncio
 import csv
-import math
 import functools
-import statistics
+from dataclasses import dataclass
 
-import tiktoken
-from budget_parser import find_latest_valid_budget
+from budget_parser import BudgetTimeline, ParsedBudget, load_budget
+import glob
 import os
-import openai
-from itertools import chain
+import time
+from itertools import chain, zip_longest
 
-from file_paths import EXPENSES_STATEMENT_PRE_CATEGORISE_DIR, EXPENSES_STATEMENT_POST_CATEGORISE_DIR
+from categorisation_cache import CategorisationCache
+from categorisation_checkpoint import CategorisationCheckpoint
+from local_classifier import LocalClassifier
+from metrics import logger, metrics
+from rate_limiter import RateLimitScheduler
+from report_checkpoints import file_digest
 
-openai.api_key = os.getenv("OPENAI_API_KEY")
+from file_paths import EXPENSES_STATEMENT_PRE_CATEGORISE_DIR, EXPENSES_STATEMENT_POST_CATEGORISE_DIR, \
+    EXPENSES_STATEMENT_CSV_PATTERN, CATEGORISATION_CACHE_FILE, LOCAL_CLASSIFIER_FILE, CATEGORISATION_CHECKPOINT_FILE
 
+MODEL: str = os.getenv("OPENAI_MODEL", "text-davinci-003")
+TOKEN_ENCODING: str = os.getenv("OPENAI_TOKEN_ENCODING")  # overrides the encoding tiktoken knows for MODEL
 MAX_TOKENS: int = 2048
-MAX_INPUT_TOKENS: int = int(MAX_TOKENS / 2)
+RESPONSE_BUFFER_TOKENS: int = 16  # the model tends to lead its response with blank lines
+MAX_CONCURRENCY: int = int(os.getenv("OPENAI_MAX_CONCURRENCY", "4"))
+REQUESTS_PER_MINUTE: int = int(os.getenv("OPENAI_REQUESTS_PER_MINUTE", "60"))
+TOKENS_PER_MINUTE: int = int(os.getenv("OPENAI_TOKENS_PER_MINUTE", "150000"))
+MAX_RETRIES: int = 5
+MAX_REPAIR_ATTEMPTS: int = 2  # re-requests for rows missing or invalid in a response before they are left Uncategorised
+COMPACT_PROMPTS: bool = os.getenv("OPENAI_COMPACT_PROMPTS", "1") != "0"  # rows answered as index,id pairs
+LOCAL_CLASSIFIER_THRESHOLD: float = float(os.getenv("LOCAL_CLASSIFIER_THRESHOLD", "0.6"))
 
 # cl100k_base	gpt-4, gpt-3.5-turbo, text-embedding-ada-002
 # p50k_base	Codex models, text-davinci-002, text-davinci-003
@@ -22,61 +37,78 @@ MAX_INPUT_TOKENS: int = int(MAX_TOKENS / 2)
 #
 # source: https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
 
-token_encoder = tiktoken.get_encoding("p50k_base")  # TODO: make this customisable so we can switch models easily
+
+@functools.lru_cache()
+def token_encoder(model: str = MODEL):
+    # loaded on first use so runs that never build a prompt don't pay for the tokenizer
+    import tiktoken
+    if TOKEN_ENCODING is not None:
+        return tiktoken.get_encoding(TOKEN_ENCODING)
+    return tiktoken.encoding_for_model(model)
+
+
+@functools.lru_cache()
+def openai_client():
+    # imported on first request, settings already made on the module (e.g. by benchmark.py) are kept
+    import openai
+    openai.api_key = os.getenv("OPENAI_API_KEY", openai.api_key)
+    openai.api_base = os.getenv("OPENAI_API_BASE", openai.api_base)  # e.g. fake_completion_server.py for local runs
+    return openai
 
 
 # Assumes budget has the following structure:
 # Category, Sub-Category, Budget, Ignore
 
-def gpt_friendly_budget(monthly_budgets: list[str], statement: str) -> str:
-    budget = find_latest_valid_budget(monthly_budgets, statement)
-    return gpt_friendly_budget_parse(budget)
+def gpt_friendly_budget(budget_timeline: BudgetTimeline, statement: str) -> str:
+    return gpt_friendly_budget_text(budget_timeline.parsed_budget(statement))
 
 
-@functools.lru_cache()
 def gpt_friendly_budget_parse(budget: str) -> str:
-    output = ""
-    with open(budget) as file:
-        reader = csv.reader(file)
-        header_row = True
-        for row in reader:
-            if header_row:
-                ignore_index = row.index("Ignore")
-                header_row = False
-                row.pop()  # Ignore
-                row.pop()  # Budget
-                output = output + ",".join(row) + "\n"
-            else:
-                if row[ignore_index] == "1":
-                    continue
-                else:
-                    row.pop()  # Ignore
-                    row.pop()  # Budget
-                    output = output + ",".join(row) + "\n"
-    return output
+    return gpt_friendly_budget_text(load_budget(budget))
+
+
+def gpt_friendly_budget_text(parsed_budget: ParsedBudget) -> str:
+    # drops the trailing Budget and Ignore columns
+    output_rows = [parsed_budget.header_row[:-2]] + list(map(lambda row: row[:-2], parsed_budget.included_rows()))
+    return "".join(map(lambda row: ",".join(row) + "\n", output_rows))
+
+
+def gpt_friendly_budget_compact_text(parsed_budget: ParsedBudget) -> tuple[str, dict[str, tuple[str, str]]]:
+    # numbers each (Category, Sub-Category) so responses can refer to it by id, returns the text and the id lookup
+    category_ids = {}
+    for row in parsed_budget.included_rows():
+        pair = (row[parsed_budget.category_index], row[parsed_budget.sub_category_index])
+        if pair not in category_ids.values():
+            category_ids[str(len(category_ids) + 1)] = pair
+    output_rows = [["Id", "Category", "Sub-Category"]] + [[category_id, pair[0], pair[1]]
+                                                          for category_id, pair in category_ids.items()]
+    return "".join(map(lambda row: ",".join(row) + "\n", output_rows)), category_ids
+
+
+@functools.lru_cache(maxsize=64)
+def statement_csv_rows(statement: str, digest: str) -> tuple[tuple[str, ...], ...]:
+    # every row of one version of a statement, keyed on its digest rather than its path so a statement rewritten
+    # while watch runs is read again. Callers that need several views of a statement pass the same digest so they
+    # all come from one read
+    with open(statement) as file:
+        return tuple(map(tuple, csv.reader(file)))
 
 
 # Assumes statement has the following structure:
 # Date, Description, Debit, Credit
-@functools.lru_cache()
-def gpt_friendly_statement(statement: str) -> str:
-    output = ""
-    with open(statement) as file:
-        reader = csv.reader(file)
-        for row in reader:
-            row.pop(0)  # Date
-            row.pop()  # Balance
-            output = output + ",".join(row) + "\n"
-    return output
+def gpt_friendly_statement(statement: str, digest: str = None) -> str:
+    # drops the Date and Balance columns
+    rows = statement_csv_rows(statement, digest or file_digest(statement))
+    return "".join(map(lambda row: ",".join(row[1:-1]) + "\n", rows))
 
 
-def gpt_friendly_statement_header(statement: str) -> str:
-    friendly_statement = gpt_friendly_statement(statement)
+def gpt_friendly_statement_header(statement: str, digest: str = None) -> str:
+    friendly_statement = gpt_friendly_statement(statement, digest)
     return friendly_statement.split("\n")[0]
 
 
-def gpt_friendly_statement_no_header(statement: str) -> str:
-    friendly_statement = gpt_friendly_statement(statement)
+def gpt_friendly_statement_no_header(statement: str, digest: str = None) -> str:
+    friendly_statement = gpt_friendly_statement(statement, digest)
     return "\n".join(friendly_statement.split("\n")[1:])
 
 
@@ -90,119 +122,423 @@ def pre_statement_prompt() -> str:
            "transactions in the order received.\n"
 
 
-def longest_row_by_token(statement_rows: list[str]) -> int:
-    token_count_per_row = tokens_by_row(statement_rows)
-    token_count_per_row.sort()
-    return token_count_per_row[-1]
-
-
-def tokens_by_row(statement_rows: list[str]) -> list[int]:
-    clean_statement_rows = list(filter(lambda row: len(row) != 0, statement_rows))
-    tokenized_rows = list(map(lambda row: token_encoder.encode(row), clean_statement_rows))
-    token_count_per_row = list(map(lambda row: len(row), tokenized_rows))
-    return token_count_per_row
-
-
-def number_rows_per_prompt(statement_rows: list[str], number_tokens_for_statement: int) -> int:
-    tokens_rows = tokens_by_row(statement_rows)
-    median_row_token_count = statistics.median(tokens_rows)
-    # this is a pretty good solution, because the standard deviation is likely to be quite low
-    # (i.e. rows are approximately the same length)
-    # it could be further optimised to make use of the tokens per request
-    # this is because the pre-prompt and budget is sent in each request, which burns tokens unnecessarily
-    # also, because we are sending that each time, and we only get back the transactions, the actual token count
-    # per request could be something like, REQUEST_TOKENS = PRE_TRANSACTIONS_TOKENS + TRANSACTIONS_TOKENS
-    # RESPONSE_TOKENS = TRANSACTIONS_TOKENS + some_buffer (to allow for categories and sub-categories)
-    # MAX_TOKENS = REQUEST_TOKENS + RESPONSE_TOKENS
-    # or, MAX_TOKENS = PRE_TRANSACTIONS_TOKENS + 2*TRANSACTIONS_TOKENS + some_buffer
-    return math.floor(number_tokens_for_statement / median_row_token_count)
-
-
-def prepare_prompts(budget: str, gpt_statement_header: str, statement_rows: list[str],
-                    rows_per_prompt: int) -> list[str]:
-    full_pre_prompt = pre_budget_prompt() + "\n" + budget + "\n" + pre_statement_prompt() + "\n" + gpt_statement_header
+def pre_statement_prompt_compact() -> str:
+    return "Using the categories and sub-categories, categorise the transactions that follow. Each transaction " \
+           "starts with its row number. Give the result in csv format as: Row,Id where Id is the id of the " \
+           "sub-category. Do not provide any other text.\n"
+
+
+@dataclass
+class PromptContext:
+    # everything shared by the prompts for rows categorised against one budget, kept so failed rows can be
+    # re-requested with the same instructions
+    pre_prompt: str
+    pre_prompt_token_count: int
+    budget_categories: set[tuple[str, str]]
+    response_row_token_count: int  # the most tokens a response adds per row on top of any echoed row text
+    category_ids: dict[str, tuple[str, str]] = None  # set for compact prompts
+
+
+@dataclass
+class Prompt:
+    text: str
+    prompt_tokens: int
+    context: PromptContext
+    rows: list[str]
+    row_ids: list[tuple[str, int]]
+
+
+def row_token_counts(statement_rows: list[str]) -> list[int]:
+    # each row is encoded exactly once, including the newline that separates it from the next row in a prompt
+    return [len(token_encoder().encode(row + "\n")) for row in statement_rows]
+
+
+def category_columns_token_count(budget_categories: set[tuple[str, str]]) -> int:
+    # the most tokens a response row can add on top of echoing the statement row
+    return max(map(lambda pair: len(token_encoder().encode("," + pair[0] + "," + pair[1])), budget_categories))
+
+
+def compact_response_row_token_count(category_ids: dict[str, tuple[str, str]]) -> int:
+    # no prompt holds more rows than MAX_TOKENS so its index is the longest a response can repeat
+    return len(token_encoder().encode("{},{}\n".format(MAX_TOKENS, max(category_ids, key=len))))
+
+
+def pack_prompt_rows(row_costs: list[int], pre_prompt_token_count: int) -> list[tuple[int, int]]:
+    # Greedily fills each prompt with as many rows as fit in MAX_TOKENS, counting both directions of the request:
+    # REQUEST_TOKENS = PRE_TRANSACTIONS_TOKENS + TRANSACTIONS_TOKENS
+    # RESPONSE_TOKENS = RESPONSE_ROW_TOKENS per row + RESPONSE_BUFFER_TOKENS
+    # row_costs holds the request and response tokens of each row, returns the (start, end) row slice of each prompt
+    row_budget = MAX_TOKENS - pre_prompt_token_count - RESPONSE_BUFFER_TOKENS
+    row_slices = []
+    start = 0
+    used_tokens = 0
+    for index, row_cost in enumerate(row_costs):
+        if row_cost > row_budget:
+            raise Exception("Statement row {} needs {} tokens but only {} are available per prompt!"
+                            .format(index, row_cost, row_budget))
+        if used_tokens + row_cost > row_budget:
+            row_slices.append((start, index))
+            start = index
+            used_tokens = 0
+        used_tokens = used_tokens + row_cost
+    if start < len(row_costs):
+        row_slices.append((start, len(row_costs)))
+    return row_slices
+
+
+def prepare_prompt_context(parsed_budget: ParsedBudget, gpt_statement_header: str,
+                           compact: bool = COMPACT_PROMPTS) -> PromptContext:
+    budget_categories = parsed_budget.category_pairs()
+    if not compact:
+        full_pre_prompt = pre_budget_prompt() + "\n" + gpt_friendly_budget_text(parsed_budget) + "\n" + \
+                          pre_statement_prompt() + "\n" + gpt_statement_header + "\n"
+        return PromptContext(full_pre_prompt, len(token_encoder().encode(full_pre_prompt)), budget_categories,
+                             category_columns_token_count(budget_categories))
+    budget, category_ids = gpt_friendly_budget_compact_text(parsed_budget)
+    full_pre_prompt = pre_budget_prompt() + "\n" + budget + "\n" + pre_statement_prompt_compact() + "\n" + \
+                      "Row," + gpt_statement_header + "\n"
+    return PromptContext(full_pre_prompt, len(token_encoder().encode(full_pre_prompt)), budget_categories,
+                         compact_response_row_token_count(category_ids), category_ids)
+
+
+def prepare_prompts(context: PromptContext, statement_rows: list[str], row_ids: list[tuple[str, int]]) -> list[Prompt]:
+    token_counts = row_token_counts(statement_rows)
+    if context.category_ids is None:
+        # the response echoes each row before its category columns
+        row_costs = [2 * token_count + context.response_row_token_count for token_count in token_counts]
+    else:
+        # each row is sent behind its index and answered with only index,id
+        index_token_count = len(token_encoder().encode("{},".format(MAX_TOKENS)))
+        token_counts = [token_count + index_token_count for token_count in token_counts]
+        row_costs = [token_count + context.response_row_token_count for token_count in token_counts]
+    row_slices = pack_prompt_rows(row_costs, context.pre_prompt_token_count)
     prompts = []
-    copy_statement_rows = statement_rows.copy()
-    for _ in range(0, len(statement_rows) - rows_per_prompt, rows_per_prompt):
-        full_statement_for_prompt = ""
-        for _ in range(0, rows_per_prompt):
-            full_statement_for_prompt = full_statement_for_prompt + copy_statement_rows.pop(0) + "\n"
-        prompts.append(full_pre_prompt + "\n" + full_statement_for_prompt)
-    final_statement = ""
-    for _ in range(0, len(copy_statement_rows)):
-        final_statement = final_statement + copy_statement_rows.pop(0) + "\n"
-    if final_statement != "":
-        prompts.append(full_pre_prompt + "\n" + final_statement)
+    for start, end in row_slices:
+        if context.category_ids is None:
+            prompt_rows = map(lambda row: row + "\n", statement_rows[start:end])
+        else:
+            prompt_rows = map(lambda indexed_row: "{},{}\n".format(indexed_row[0] + 1, indexed_row[1]),
+                              enumerate(statement_rows[start:end]))
+        prompt_text = context.pre_prompt + "".join(prompt_rows)
+        prompts.append(Prompt(prompt_text, context.pre_prompt_token_count + sum(token_counts[start:end]), context,
+                              statement_rows[start:end], row_ids[start:end]))
     return prompts
 
 
-def rebuild_categorised_statement(categorised_rows: list[list[str]], statement_file: str) -> None:
-    rebuilt_csv = []
-    with open(statement_file) as file:
-        reader = csv.reader(file)
-        row_count = 0
-        for row in reader:
-            if row_count is 0:
-                categorised_row = ["Category", "Sub-Category"]
-                row.extend(categorised_row)
+def parse_category_columns(category_columns: str) -> tuple[str, str]:
+    fields = list(map(lambda field: field.strip().strip('"').strip(), category_columns.split(",")))
+    if len(fields) != 2:
+        return None
+    return fields[0], fields[1]
+
+
+def align_response(response_text: str, statement_rows: list[str],
+                   budget_categories: set[tuple[str, str]]) -> list[tuple[str, str]]:
+    # Matches each response line to the statement row it echoes rather than trusting its position, so blank lines,
+    # dropped rows or commas inside a description only affect the rows concerned. Returns the (Category,
+    # Sub-Category) for each statement row, None where the row is missing or its pair is not in the budget
+    aligned = [None] * len(statement_rows)
+    next_row = 0
+    for line in response_text.split("\n"):
+        line = line.strip()
+        if len(line) == 0:
+            continue
+        for index in range(next_row, len(statement_rows)):
+            echoed_row = statement_rows[index].strip() + ","
+            if line.startswith(echoed_row):
+                pair = parse_category_columns(line[len(echoed_row):])
+                if pair in budget_categories:
+                    aligned[index] = pair
+                next_row = index + 1
+                break
+    return aligned
+
+
+def align_compact_response(response_text: str, row_count: int,
+                           category_ids: dict[str, tuple[str, str]]) -> list[tuple[str, str]]:
+    # each line is Row,Id so rows are found by index, unknown indices and ids are ignored
+    aligned = [None] * row_count
+    for line in response_text.split("\n"):
+        fields = list(map(lambda field: field.strip().strip('"').strip(), line.split(",")))
+        if len(fields) != 2 or not fields[0].isdigit():
+            continue
+        index = int(fields[0]) - 1
+        if 0 <= index < row_count and aligned[index] is None:
+            aligned[index] = category_ids.get(fields[1])
+    return aligned
+
+
+def add_pending_rows(pending_rows: dict, context: PromptContext, rows: list[str],
+                     row_ids: list[tuple[str, int]]) -> None:
+    # rows are grouped by the context they are categorised against, whichever statement they came from
+    context, context_rows, context_row_ids = pending_rows.setdefault(id(context), (context, [], []))
+    context_rows.extend(rows)
+    context_row_ids.extend(row_ids)
+
+
+def pending_prompts(pending_rows: dict) -> list[Prompt]:
+    return list(chain.from_iterable(prepare_prompts(context, rows, row_ids)
+                                    for context, rows, row_ids in pending_rows.values()))
+
+
+def categorise_prompts(prompts: list[Prompt], max_concurrency: int, checkpoint: CategorisationCheckpoint) -> None:
+    # Sends the prompts and validates each response as it arrives, valid rows are appended to the checkpoint
+    # straight away. Rows that are missing or invalid are packed into new, smaller prompts against the same budget,
+    # rows still failing after MAX_REPAIR_ATTEMPTS are left out of the checkpoint and written as Uncategorised
+    for attempt in range(0, MAX_REPAIR_ATTEMPTS + 1):
+        failed_rows = {}
+
+        def on_completion(prompt: Prompt, response_text: str) -> None:
+            if prompt.context.category_ids is None:
+                aligned = align_response(response_text, prompt.rows, prompt.context.budget_categories)
             else:
-                categorised_row: list[str] = categorised_rows[row_count - 1]
-                category_columns = categorised_row[-2:]
-                row.extend(category_columns)
-            rebuilt_csv.append(row)
-            row_count = row_count + 1
-        print("csv rows:{}".format(row_count))
-    print(rebuilt_csv)
+                aligned = align_compact_response(response_text, len(prompt.rows), prompt.context.category_ids)
+            for row, row_id, pair in zip(prompt.rows, prompt.row_ids, aligned):
+                if pair is None:
+                    add_pending_rows(failed_rows, prompt.context, [row], [row_id])
+                else:
+                    checkpoint.append(row_id[0], row_id[1], pair)
+            checkpoint.flush()
+
+        openai_completions(prompts, max_concurrency, on_completion)
+        failed_count = sum(map(lambda failed: len(failed[1]), failed_rows.values()))
+        if failed_count == 0:
+            return
+        metrics.increment("invalid_rows", failed_count)
+        if attempt == MAX_REPAIR_ATTEMPTS:
+            logger.warning("%d rows could not be categorised after %d attempts, leaving them Uncategorised",
+                           failed_count, MAX_REPAIR_ATTEMPTS + 1)
+            return
+        logger.info("re-requesting %d rows missing or invalid in the responses", failed_count)
+        prompts = pending_prompts(failed_rows)
+
+
+def statement_descriptions(statement: str, digest: str = None) -> list[str]:
+    rows = statement_csv_rows(statement, digest or file_digest(statement))
+    description_index = rows[0].index("Description")
+    return [row[description_index] for row in rows[1:]]
+
+
+def rebuild_categorised_statement(category_pairs, statement_file: str) -> str:
+    # category_pairs is consumed lazily alongside the source rows, the output is written under a name the statement
+    # pattern does not match and only renamed into place once complete
     file_name = statement_file[len(EXPENSES_STATEMENT_PRE_CATEGORISE_DIR):]
     categorised_file_name = EXPENSES_STATEMENT_POST_CATEGORISE_DIR + file_name
-    with open(categorised_file_name, "w") as file:
-        writer = csv.writer(file)
-        writer.writerows(rebuilt_csv)
-
-
-def categorise_statement(monthly_budgets: list[str], statement_file: str) -> None:
-    gpt_budget = gpt_friendly_budget(monthly_budgets, statement_file)
-    gpt_statement_header = gpt_friendly_statement_header(statement_file)
-    gpt_statement_no_header = gpt_friendly_statement_no_header(statement_file)
-    pre_budget_prompt_text = pre_budget_prompt()
-    pre_statement_prompt_text = pre_statement_prompt()
-
-    budget_tokens = token_encoder.encode(gpt_budget)
-    pre_budget_prompt_text_tokens = token_encoder.encode(pre_budget_prompt_text)
-    pre_statement_prompt_text_tokens = token_encoder.encode(pre_statement_prompt_text)
-    gpt_statement_header_tokens = token_encoder.encode(gpt_statement_header)
-    budget_tokens_count = len(budget_tokens)
-    pre_budget_prompt_text_tokens_count = len(pre_budget_prompt_text_tokens)
-    pre_statement_prompt_text_tokens_count = len(pre_statement_prompt_text_tokens)
-    gpt_statement_header_tokens_count = len(gpt_statement_header_tokens)
-
-    tokens_for_statement = MAX_INPUT_TOKENS - pre_budget_prompt_text_tokens_count - budget_tokens_count - \
-                           pre_statement_prompt_text_tokens_count - gpt_statement_header_tokens_count
-
-    statement_rows: list[str] = gpt_statement_no_header.split("\n")
-    rows_per_prompt = number_rows_per_prompt(statement_rows, tokens_for_statement)
-    prompts = prepare_prompts(gpt_budget, gpt_statement_header, statement_rows, rows_per_prompt)
-
-    all_categorised_rows = list(openai_completions_generator(prompts))
-    print(all_categorised_rows)
-    all_rows_flattened = list(chain.from_iterable(all_categorised_rows))
-    print(all_rows_flattened)
-    print("rows:{}".format(len(all_rows_flattened)))
-
-    rebuild_categorised_statement(all_rows_flattened, statement_file)
-
-
-def openai_completions_generator(prompts: list[str]) -> list[list[str]]:
-    for prompt in prompts:
-        print(prompt)
-        response = openai.Completion.create(
-            model="text-davinci-003",
-            prompt=prompt,
-            max_tokens=2048
-        )
-        print(response)
-        response_text = response.choices[0].text  # TODO: error handling!
-        print(response_text)
-        # TODO: refer to logs/openai_freakout.txt for conditions where the outputted text is not perfect
-        # TODO: we should be able to handle these cases if possible
-        yield list(map(lambda row: row.split(","), response_text.split("\n")))
+    partial_file_name = categorised_file_name + ".partial"
+    with open(statement_file) as file, open(partial_file_name, "w") as partial_file:
+        reader = csv.reader(file)
+        writer = csv.writer(partial_file)
+        writer.writerow(next(reader) + ["Category", "Sub-Category"])
+        row_count = 1
+        mismatch = None
+        for row, category_pair in zip_longest(reader, category_pairs):
+            if row is None or category_pair is None:
+                mismatch = "too few" if category_pair is None else "too many"
+                break
+            writer.writerow(row + list(category_pair))
+            row_count = row_count + 1
+    if mismatch is not None:
+        # a row without a category (or the reverse) means the statement changed underneath the run
+        os.remove(partial_file_name)
+        raise Exception("{} has {} category pairs for its rows!".format(statement_file, mismatch))
+    os.replace(partial_file_name, categorised_file_name)
+    logger.info("%s: %d csv rows", statement_file, row_count)
+    return categorised_file_name
+
+
+def statement_category_pairs(cached_pairs: list[tuple[str, str]], resolved_pairs: dict[int, tuple[str, str]]):
+    for position, cached_pair in enumerate(cached_pairs):
+        if cached_pair is None:
+            yield resolved_pairs.get(position, ("Uncategorised", "Uncategorised"))
+        else:
+            yield cached_pair
+
+
+def statement_pending_rows(budget_timeline: BudgetTimeline, statement_file: str, cache: CategorisationCache,
+                           classifier: LocalClassifier, checkpoint: CategorisationCheckpoint,
+                           contexts: dict) -> tuple[PromptContext, list[str], list[tuple[str, int]], list]:
+    # Rows already known to the cache, that the local classifier is confident about or that an interrupted run
+    # checkpointed are returned categorised, the remaining rows are returned with the context to prompt them in.
+    # Statements with the same effective budget and header share one context so their rows can be packed together
+    parsed_budget = budget_timeline.parsed_budget(statement_file)
+    budget_categories = parsed_budget.category_pairs()
+    cache.use_budget(parsed_budget.budget, budget_categories)
+    # the prompt text and descriptions come from the same version of the statement
+    digest = file_digest(statement_file)
+    gpt_statement_header = gpt_friendly_statement_header(statement_file, digest)
+    gpt_statement_no_header = gpt_friendly_statement_no_header(statement_file, digest)
+
+    statement_rows: list[str] = list(filter(lambda row: len(row) != 0, gpt_statement_no_header.split("\n")))
+    resolved_pairs = checkpoint.resolved(statement_file)
+    cached_pairs = []
+    uncached_statement_rows = []
+    uncached_row_ids = []
+    for position, (statement_row, description) in enumerate(zip(statement_rows,
+                                                                 statement_descriptions(statement_file, digest))):
+        if position in resolved_pairs:
+            metrics.increment("resumed_rows")
+            cached_pairs.append(None)
+            continue
+        cached_pair = cache.lookup(description, budget_categories)
+        if cached_pair is None:
+            cached_pair, confidence = classifier.classify(description, budget_categories)
+            if confidence < LOCAL_CLASSIFIER_THRESHOLD:
+                cached_pair = None
+            else:
+                metrics.increment("local_classified")
+        if cached_pair is None:
+            cached_pairs.append(None)
+            uncached_statement_rows.append(statement_row)
+            uncached_row_ids.append((statement_file, position))
+        else:
+            cached_pairs.append(cached_pair)
+
+    context_key = (parsed_budget.budget, gpt_statement_header)
+    if context_key not in contexts and len(uncached_statement_rows) != 0:
+        contexts[context_key] = prepare_prompt_context(parsed_budget, gpt_statement_header)
+    return contexts.get(context_key), uncached_statement_rows, uncached_row_ids, cached_pairs
+
+
+def categorise_statement(budget_timeline: BudgetTimeline, statement_file: str) -> None:
+    categorise_statements(budget_timeline, [statement_file])
+
+
+def categorise_statements(budget_timeline: BudgetTimeline, statement_files: list[str],
+                          max_concurrency: int = MAX_CONCURRENCY, cache: CategorisationCache = None,
+                          classifier: LocalClassifier = None) -> list[str]:
+    # returns the post-categorise files written. Long running callers pass the same cache and classifier to every
+    # call so they are only loaded once, otherwise both are loaded from their files
+    with metrics.stage("categorise_statements"):
+        return categorise_statements_uninstrumented(budget_timeline, statement_files, max_concurrency, cache,
+                                                    classifier)
+
+
+def categorise_statements_uninstrumented(budget_timeline: BudgetTimeline, statement_files: list[str],
+                                         max_concurrency: int, cache: CategorisationCache = None,
+                                         classifier: LocalClassifier = None) -> list[str]:
+    # seeding and training only read post-categorise statements that are new or modified since they were last seen
+    categorised_statements = glob.glob(EXPENSES_STATEMENT_POST_CATEGORISE_DIR + EXPENSES_STATEMENT_CSV_PATTERN)
+    if cache is None:
+        cache = CategorisationCache(CATEGORISATION_CACHE_FILE)
+    cache.seed(categorised_statements)
+    if classifier is None:
+        classifier = LocalClassifier(LOCAL_CLASSIFIER_FILE)
+    classifier.train(categorised_statements)
+
+    # rows from every statement are packed and sent together so statements sharing a budget fill each other's
+    # prompts and the whole backlog shares the concurrency limit, row ids route the results back to each statement
+    checkpoint = CategorisationCheckpoint(CATEGORISATION_CHECKPOINT_FILE)
+    contexts = {}
+    pending_rows = {}
+    cached_pairs_per_statement = []
+    for statement_file in statement_files:
+        context, rows, row_ids, cached_pairs = statement_pending_rows(budget_timeline, statement_file, cache,
+                                                                      classifier, checkpoint, contexts)
+        if len(rows) != 0:
+            add_pending_rows(pending_rows, context, rows, row_ids)
+        cached_pairs_per_statement.append(cached_pairs)
+    all_prompts = pending_prompts(pending_rows)
+    total_rows = sum(map(len, cached_pairs_per_statement))
+    local_rows = sum(map(lambda cached_pairs: len(cached_pairs) - cached_pairs.count(None),
+                         cached_pairs_per_statement))
+    logger.info("cache hits:%d misses:%d, %d of %d rows (%.0f%%) categorised without the API", cache.hits,
+                cache.misses, local_rows, total_rows, 100 * local_rows / total_rows if total_rows else 100)
+    metrics.increment("cache_hits", cache.hits)
+    metrics.increment("cache_misses", cache.misses)
+    logger.info("%d rows from %d statements packed into %d prompts",
+                sum(map(lambda pending: len(pending[1]), pending_rows.values())), len(statement_files),
+                len(all_prompts))
+    try:
+        with metrics.stage("openai_completions"):
+            categorise_prompts(all_prompts, max_concurrency, checkpoint)
+    finally:
+        checkpoint.close()
+
+    categorised_file_names = []
+    for statement_file, cached_pairs in zip(statement_files, cached_pairs_per_statement):
+        category_pairs = statement_category_pairs(cached_pairs, checkpoint.resolved(statement_file))
+        categorised_file_name = rebuild_categorised_statement(category_pairs, statement_file)
+        cache.seed([categorised_file_name])
+        classifier.train([categorised_file_name])
+        categorised_file_names.append(categorised_file_name)
+    cache.save()
+    classifier.save()
+    checkpoint.remove()
+    return categorised_file_names
+
+
+def record_completion_usage(response, latency: float, retries: int) -> None:
+    usage = response.get("usage", {})
+    prompt_tokens = usage.get("prompt_tokens", 0)
+    completion_tokens = usage.get("completion_tokens", 0)
+    metrics.increment("api_requests")
+    metrics.increment("prompt_tokens", prompt_tokens)
+    metrics.increment("completion_tokens", completion_tokens)
+    metrics.emit({"event": "completion", "latency": latency, "prompt_tokens": prompt_tokens,
+                  "completion_tokens": completion_tokens, "retries": retries})
+    logger.info("completion in %.2fs, %d prompt and %d completion tokens", latency, prompt_tokens,
+                completion_tokens)
+
+
+def openai_completions(prompts: list[Prompt], max_concurrency: int = MAX_CONCURRENCY,
+                       on_completion=None) -> list[str]:
+    # results are returned in the same order as the prompts regardless of completion order, on_completion is
+    # called with each prompt and its response text as soon as that response arrives
+    return asyncio.run(openai_completions_gather(prompts, max_concurrency, on_completion))
+
+
+async def openai_completions_gather(prompts: list[Prompt], max_concurrency: int, on_completion=None) -> list[str]:
+    semaphore = asyncio.Semaphore(max_concurrency)
+    scheduler = RateLimitScheduler(REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE)
+
+    async def completed(prompt: Prompt) -> str:
+        response_text = await openai_completion(prompt, semaphore, scheduler)
+        if on_completion is not None:
+            on_completion(prompt, response_text)
+        return response_text
+
+    # a failed request must not cancel the others, their responses are still checkpointed before the first error
+    # is raised
+    results = await asyncio.gather(*[completed(prompt) for prompt in prompts], return_exceptions=True)
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if len(errors) != 0:
+        logger.error("%d of %d requests failed", len(errors), len(prompts))
+        raise errors[0]
+    return results
+
+
+async def openai_completion(prompt: Prompt, semaphore: asyncio.Semaphore,
+                            scheduler: RateLimitScheduler) -> str:
+    # the response may use whatever the prompt leaves of MAX_TOKENS, rate limits count the requested max_tokens
+    # against the token budget, not just the tokens used
+    max_completion_tokens = MAX_TOKENS - prompt.prompt_tokens
+    openai = openai_client()
+    async with semaphore:
+        for attempt in range(0, MAX_RETRIES + 1):
+            await scheduler.acquire(MAX_TOKENS)
+            logger.debug("%s", prompt.text)
+            request_start = time.perf_counter()
+            try:
+                response = await openai.Completion.acreate(
+                    model=MODEL,
+                    prompt=prompt.text,
+                    max_tokens=max_completion_tokens
+                )
+            except (openai.error.RateLimitError, openai.error.APIError, openai.error.Timeout,
+                    openai.error.ServiceUnavailableError, openai.error.APIConnectionError,
+                    openai.error.TryAgain) as error:
+                # rate limits and transient server or network errors back off and retry, anything else is raised
+                if attempt == MAX_RETRIES:
+                    raise
+                retry_after = error.headers.get("Retry-After") if error.headers else None
+                delay = scheduler.backoff(float(retry_after) if retry_after is not None else None)
+                logger.info("%s, retrying in %.1fs", "rate limited" if isinstance(error, openai.error.RateLimitError)
+                            else "request failed ({})".format(type(error).__name__), delay)
+                metrics.increment("api_retries")
+                continue
+            scheduler.recover()
+            record_completion_usage(response, time.perf_counter() - request_start, attempt)
+            logger.debug("%s", response)
+            # the text is validated row by row in categorise_prompts, see logs/openai_freakout.txt for the kind of
+            # output it has to cope with
+            return response.choices[0].text
@@ -0,0 +1,109 @@
+import csv
+import hashlib
+import os
+from collections import deque
+
+from ledger import money_to_cents, cents_to_money
+
+OVERSPEND_STREAK_MONTHS: int = 3  # months in a row with a negative remainder before a sub-category is flagged
+UNDERSPEND_STREAK_MONTHS: int = 3  # months in a row spending at most UNDERSPEND_RATIO of the budget
+UNDERSPEND_RATIO: float = 0.5
+WINDOW_MONTHS: int = 12  # trailing months of spend the annual projection is based on
+
+
+def load_irregular_categories(irregular_categories_file: str) -> set[tuple[str, str]]:
+    # Category,Sub-Category rows for irregular expenses such as annual insurance, an empty Sub-Category covers the
+    # whole category. A missing file means no irregular categories
+    if not os.path.exists(irregular_categories_file):
+        return set()
+    with open(irregular_categories_file) as file:
+        reader = csv.reader(file)
+        header_row = next(reader)
+        category_index = header_row.index("Category")
+        sub_category_index = header_row.index("Sub-Category")
+        return set(map(lambda row: (row[category_index], row[sub_category_index]), reader))
+
+
+def habit_settings_key(irregular_categories: set[tuple[str, str]]) -> str:
+    # changes whenever the thresholds or allow-list change so report checkpoints made with other settings are stale
+    settings = [OVERSPEND_STREAK_MONTHS, UNDERSPEND_STREAK_MONTHS, UNDERSPEND_RATIO, WINDOW_MONTHS] + \
+        sorted(irregular_categories)
+    return hashlib.sha256(repr(settings).encode()).hexdigest()
+
+
+class SubCategoryHabits:
+    # Streaks and the rolling WINDOW_MONTHS spend of one sub-category, each month is an O(1) update
+    def __init__(self, state: dict = None):
+        state = state or {}
+        self.over_streak = state.get("over_streak", 0)
+        self.under_streak = state.get("under_streak", 0)
+        self.budget = state.get("budget", 0)
+        self.spends = deque(state.get("spends", []))
+        self.spend_total = sum(self.spends)
+
+    def update(self, budget_cents: int, spend_cents: int, remainder_cents: int) -> None:
+        self.over_streak = self.over_streak + 1 if remainder_cents < 0 else 0
+        underspent = budget_cents > 0 and spend_cents <= budget_cents * UNDERSPEND_RATIO
+        self.under_streak = self.under_streak + 1 if underspent else 0
+        self.budget = budget_cents
+        self.spends.append(spend_cents)
+        self.spend_total = self.spend_total + spend_cents
+        if len(self.spends) > WINDOW_MONTHS:
+            self.spend_total = self.spend_total - self.spends.popleft()
+
+    def annualised(self) -> tuple[int, int]:
+        # (projected spend, budget) for a year in cents. The spend is the trailing window as is rather than scaled
+        # from fewer months, an annual charge in the first month must not project to twelve of them
+        return self.spend_total * 12 // WINDOW_MONTHS, self.budget * 12
+
+    def state(self) -> dict:
+        return {"over_streak": self.over_streak, "under_streak": self.under_streak, "budget": self.budget,
+                "spends": list(self.spends)}
+
+
+class HabitTracker:
+    # Spending habit flags computed month by month from the calculator's outputs. Regular sub-categories are flagged
+    # for overspending and underspending streaks, irregular ones only when the annualised projection exceeds the
+    # annual budget since any single month says little about them
+    def __init__(self, irregular_categories: set[tuple[str, str]], state: dict = None):
+        self.irregular_categories = irregular_categories
+        self.habits = {}
+        for key, sub_category_state in (state or {}).items():
+            self.habits[tuple(key.split("\x1f"))] = SubCategoryHabits(sub_category_state)
+
+    def is_irregular(self, category: str, sub_category: str) -> bool:
+        return (category, sub_category) in self.irregular_categories or (category, "") in self.irregular_categories
+
+    def update(self, parsed_budget: dict, parsed_statement: dict, remainder: dict) -> dict[tuple[str, str], list[str]]:
+        # adds one month and returns the flags for every budgeted sub-category that has any
+        flags = {}
+        for category in parsed_budget:
+            for sub_category in parsed_budget[category]:
+                spend = parsed_statement.get(category, {}).get(sub_category)
+                habits = self.habits.get((category, sub_category))
+                if habits is None:
+                    habits = self.habits[(category, sub_category)] = SubCategoryHabits()
+                habits.update(money_to_cents(parsed_budget[category][sub_category]),
+                              0 if spend is None else money_to_cents(spend),
+                              money_to_cents(remainder[category][sub_category]))
+                sub_category_flags = self.flags(category, sub_category, habits)
+                if len(sub_category_flags) != 0:
+                    flags[(category, sub_category)] = sub_category_flags
+        return flags
+
+    def flags(self, category: str, sub_category: str, habits: SubCategoryHabits) -> list[str]:
+        if self.is_irregular(category, sub_category):
+            projected_cents, annual_budget_cents = habits.annualised()
+            if projected_cents > annual_budget_cents:
+                return ["Projected {} of {} a year".format(cents_to_money(projected_cents).amount_as_string(),
+                                                           cents_to_money(annual_budget_cents).amount_as_string())]
+            return []
+        flags = []
+        if habits.over_streak >= OVERSPEND_STREAK_MONTHS:
+            flags.append("Overspent {} months".format(habits.over_streak))
+        if habits.under_streak >= UNDERSPEND_STREAK_MONTHS:
+            flags.append("Underspent {} months".format(habits.under_streak))
+        return flags
+
+    def state(self) -> dict:
+        return {"\x1f".join(key): habits.state() for key, habits in self.habits.items()}
@@ -0,0 +1,152 @@
+import numpy as np
+from stockholm import Money
+
+
+class LedgerIndex:
+    # Fixed position for every (category, sub-category) pair across all months, in first-seen budget order, and
+    # for every category
+    def __init__(self, parsed_budgets: list[dict]):
+        self.keys = []
+        self.positions = {}
+        self.category_positions = {}
+        for parsed_budget in parsed_budgets:
+            for category in parsed_budget:
+                self.category_positions.setdefault(category, len(self.category_positions))
+                for sub_category in parsed_budget[category]:
+                    if (category, sub_category) not in self.positions:
+                        self.positions[(category, sub_category)] = len(self.keys)
+                        self.keys.append((category, sub_category))
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def category_matrix(self) -> np.ndarray:
+        # (pairs, categories) one-hot so a (months, pairs) array times it sums each category
+        matrix = np.zeros((len(self.keys), len(self.category_positions)), dtype=np.int64)
+        for position, (category, _) in enumerate(self.keys):
+            matrix[position, self.category_positions[category]] = 1
+        return matrix
+
+
+def money_to_cents(money: Money) -> int:
+    sub_units = money.sub_units
+    if sub_units != int(sub_units):
+        raise Exception("Amount {} cannot be represented in whole cents!".format(money))
+    return int(sub_units)
+
+
+def cents_to_money(cents: int) -> Money:
+    return Money.from_sub_units(int(cents), "AUD")
+
+
+def to_cents(parsed_dict: dict, index: LedgerIndex) -> np.ndarray:
+    # pairs outside the index (e.g. spend in a sub-category the budget does not have) are dropped, as the
+    # calculator only ever looks up pairs from the budget
+    cents = np.zeros(len(index), dtype=np.int64)
+    for category in parsed_dict:
+        for sub_category in parsed_dict[category]:
+            position = index.positions.get((category, sub_category))
+            if position is not None:
+                cents[position] = money_to_cents(parsed_dict[category][sub_category])
+    return cents
+
+
+def budget_presence(parsed_budget: dict, index: LedgerIndex) -> np.ndarray:
+    present = np.zeros(len(index), dtype=bool)
+    for category in parsed_budget:
+        for sub_category in parsed_budget[category]:
+            present[index.positions[(category, sub_category)]] = True
+    return present
+
+
+def from_cents(cents: np.ndarray, index: LedgerIndex, shape: dict) -> dict:
+    # rebuilds the nested dict the calculator would have produced, using shape for categories and their order
+    parsed_dict = {}
+    for category in shape:
+        parsed_dict[category] = {}
+        for sub_category in shape[category]:
+            parsed_dict[category][sub_category] = cents_to_money(cents[index.positions[(category, sub_category)]])
+    return parsed_dict
+
+
+def compute_ledger(budgets: np.ndarray, spends: np.ndarray, present: np.ndarray,
+                   initial_carry: np.ndarray = None) -> dict:
+    # Computes compute_carry, compute_remainder, compute_remaining_spend and compute_next_month_available_budget
+    # for every month at once, budgets, spends and present are (months, pairs) arrays in cents
+    # The carry recurrence remainder[m] = remainder[m - 1] + budget[m] - spend[m] is a cumulative sum over months
+    # which restarts from zero carry whenever a pair is missing from a month's budget
+    months = budgets.shape[0]
+    if initial_carry is None:
+        initial_carry = np.zeros(budgets.shape[1], dtype=np.int64)
+    net = np.where(present, budgets - spends, 0)
+    running_total = np.cumsum(net, axis=0) + initial_carry
+    absent_month = np.where(present, -1, np.arange(months)[:, None])
+    last_absent_month = np.maximum.accumulate(absent_month, axis=0)
+    restart_total = np.where(last_absent_month >= 0,
+                             np.take_along_axis(running_total, np.maximum(last_absent_month, 0), axis=0), 0)
+    remainder = np.where(present, running_total - restart_total, 0)
+    carry = np.empty_like(remainder)
+    # like compute_carry the whole previous remainder is carried, pairs the month does not budget for only show in
+    # their category's total
+    carry[0] = initial_carry
+    carry[1:] = remainder[:-1]
+    return {
+        "carry": carry,
+        "remainder": remainder,
+        "remaining_spend": budgets + carry,
+        "next_month_available": budgets + remainder
+    }
+
+
+def statement_category_cents(parsed_statement: dict, category: str) -> int:
+    # all of a category's spend, including sub-categories the budget does not have
+    return sum(map(money_to_cents, parsed_statement.get(category, {}).values()))
+
+
+def compute_months(parsed_budgets: list[dict], parsed_statements: list[dict],
+                   initial_remainder: dict = None) -> list[tuple[dict, dict, dict, dict, dict]]:
+    # Batched equivalent of running the calculator chain month by month, returns the
+    # (carry, remainder, remaining_spend, next_month_available, category_totals) for each month. category_totals maps
+    # each budget category to its [budget, carry, remaining_spend, spend, remainder, next_month_available] in cents,
+    # the order of the report columns, each total sums the sub-categories the matching dict holds
+    if len(parsed_budgets) == 0:
+        return []
+    shapes = [initial_remainder] if initial_remainder is not None else []
+    index = LedgerIndex(shapes + parsed_budgets)
+    budgets = np.array([to_cents(parsed_budget, index) for parsed_budget in parsed_budgets]).reshape(-1, len(index))
+    spends = np.array([to_cents(parsed_statement, index) for parsed_statement in parsed_statements]) \
+        .reshape(-1, len(index))
+    present = np.array([budget_presence(parsed_budget, index) for parsed_budget in parsed_budgets]) \
+        .reshape(-1, len(index))
+    initial_carry = None if initial_remainder is None else to_cents(initial_remainder, index)
+    ledger = compute_ledger(budgets, spends, present, initial_carry)
+
+    # the carry dict has the shape of the month before, the others the month's own budget
+    carry_present = np.empty_like(present)
+    carry_present[0] = present[0] if initial_remainder is None else budget_presence(initial_remainder, index)
+    carry_present[1:] = present[:-1]
+    matrix = index.category_matrix()
+    budget_totals = np.where(present, budgets, 0) @ matrix
+    carry_totals = np.where(carry_present, ledger["carry"], 0) @ matrix
+    remaining_spend_totals = np.where(present, ledger["remaining_spend"], 0) @ matrix
+    remainder_totals = np.where(present, ledger["remainder"], 0) @ matrix
+    next_month_available_totals = np.where(present, ledger["next_month_available"], 0) @ matrix
+
+    months = []
+    carry_shape = parsed_budgets[0] if initial_remainder is None else initial_remainder
+    for month, (parsed_budget, parsed_statement) in enumerate(zip(parsed_budgets, parsed_statements)):
+        category_totals = {}
+        for category in parsed_budget:
+            position = index.category_positions[category]
+            category_totals[category] = [int(budget_totals[month, position]), int(carry_totals[month, position]),
+                                         int(remaining_spend_totals[month, position]),
+                                         statement_category_cents(parsed_statement, category),
+                                         int(remainder_totals[month, position]),
+                                         int(next_month_available_totals[month, position])]
+        months.append((from_cents(ledger["carry"][month], index, carry_shape),
+                       from_cents(ledger["remainder"][month], index, parsed_budget),
+                       from_cents(ledger["remaining_spend"][month], index, parsed_budget),
+                       from_cents(ledger["next_month_available"][month], index, parsed_budget),
+                       category_totals))
+        carry_shape = parsed_budget
+    return months
@@ -0,0 +1,184 @@
+import csv
+import json
+import math
+import os
+
+from categorisation_cache import normalise_description
+
+NGRAM_SIZE: int = 3
+NEIGHBOURS: int = 5
+
+
+def character_ngrams(description: str) -> dict[str, int]:
+    padded = " {} ".format(description)
+    ngrams = {}
+    for start in range(0, max(1, len(padded) - NGRAM_SIZE + 1)):
+        ngram = padded[start:start + NGRAM_SIZE]
+        ngrams[ngram] = ngrams.get(ngram, 0) + 1
+    return ngrams
+
+
+class LocalClassifier:
+    # Character n-gram TF-IDF with weighted nearest neighbours, trained on previously categorised statements
+    # Each distinct normalised description is one document labelled with how often each (Category, Sub-Category)
+    # was assigned to it. Weights depend on document frequencies so they are recomputed lazily after training
+    # seeded_files keeps each statement's modification time and the label counts it added so a corrected statement
+    # replaces its old labels instead of adding to them
+    def __init__(self, model_file: str):
+        self.model_file = model_file
+        self.seeded_files = {}
+        self.labels = {}
+        self.document_ids = {}
+        self.descriptions = []
+        self.documents = []
+        self.postings = {}
+        self.idf = {}
+        self.norms = []
+        self.stale = True
+        if os.path.exists(model_file):
+            with open(model_file) as file:
+                stored = json.load(file)
+            if all(isinstance(seeded, dict) for seeded in stored["seeded_files"].values()):
+                self.seeded_files = stored["seeded_files"]
+                for description, label_counts in stored["labels"].items():
+                    for label, count in label_counts.items():
+                        self.add_document(description, tuple(label.split("\x1f")), count)
+            # models saved without each file's labels cannot remove them so they are trained again from scratch
+
+    def save(self) -> None:
+        stored = {
+            "seeded_files": self.seeded_files,
+            "labels": {description: {"\x1f".join(label): count for label, count in label_counts.items()}
+                       for description, label_counts in self.labels.items()}
+        }
+        temporary_file = self.model_file + ".tmp"
+        with open(temporary_file, "w") as file:
+            json.dump(stored, file)
+        os.replace(temporary_file, self.model_file)
+
+    def train(self, categorised_statements: list[str]) -> None:
+        # only statements that are new or modified since they were last seen are read, a modified statement's
+        # previous labels are removed first and statements that no longer exist are forgotten
+        removed = False
+        for statement in [statement for statement in self.seeded_files if not os.path.exists(statement)]:
+            removed = self.remove_labels(self.seeded_files.pop(statement)["labels"]) or removed
+        for statement in sorted(categorised_statements):
+            modified_time = os.path.getmtime(statement)
+            seeded = self.seeded_files.get(statement)
+            if seeded is not None and seeded["modified_time"] == modified_time:
+                continue
+            if seeded is not None:
+                removed = self.remove_labels(seeded["labels"]) or removed
+            file_labels = {}
+            with open(statement) as file:
+                reader = csv.reader(file)
+                header_row = next(reader)
+                description_index = header_row.index("Description")
+                category_index = header_row.index("Category")
+                sub_category_index = header_row.index("Sub-Category")
+                for row in reader:
+                    category = row[category_index]
+                    sub_category = row[sub_category_index]
+                    if category in ("", "-", "Uncategorised") or sub_category in ("", "-", "Uncategorised"):
+                        continue
+                    description = normalise_description(row[description_index])
+                    if description == "":
+                        continue
+                    self.add_document(description, (category, sub_category), 1)
+                    label_counts = file_labels.setdefault(description, {})
+                    label = "\x1f".join((category, sub_category))
+                    label_counts[label] = label_counts.get(label, 0) + 1
+            self.seeded_files[statement] = {"modified_time": modified_time, "labels": file_labels}
+        if removed:
+            self.rebuild_documents()
+
+    def remove_labels(self, file_labels: dict) -> bool:
+        # subtracts a statement's label counts, returns whether any description was left without labels
+        emptied = False
+        for description, label_counts in file_labels.items():
+            document_labels = self.labels.get(description, {})
+            for label, count in label_counts.items():
+                label = tuple(label.split("\x1f"))
+                remaining = document_labels.get(label, 0) - count
+                if remaining > 0:
+                    document_labels[label] = remaining
+                else:
+                    document_labels.pop(label, None)
+            if len(document_labels) == 0:
+                self.labels.pop(description, None)
+                emptied = True
+        return emptied
+
+    def rebuild_documents(self) -> None:
+        # descriptions with no labels left are dropped from the index so they no longer count towards the weights
+        labels = self.labels
+        self.labels = {}
+        self.document_ids = {}
+        self.descriptions = []
+        self.documents = []
+        self.postings = {}
+        self.stale = True
+        for description, label_counts in labels.items():
+            for label, count in label_counts.items():
+                self.add_document(description, label, count)
+
+    def add_document(self, description: str, label: tuple[str, str], count: int) -> None:
+        if description == "":
+            return
+        label_counts = self.labels.setdefault(description, {})
+        label_counts[label] = label_counts.get(label, 0) + count
+        if description not in self.document_ids:
+            document_id = len(self.documents)
+            self.document_ids[description] = document_id
+            self.descriptions.append(description)
+            ngrams = character_ngrams(description)
+            self.documents.append(ngrams)
+            for ngram in ngrams:
+                self.postings.setdefault(ngram, []).append(document_id)
+            self.stale = True
+
+    def refresh_weights(self) -> None:
+        document_count = len(self.documents)
+        self.idf = {ngram: math.log((1 + document_count) / (1 + len(document_ids))) + 1
+                    for ngram, document_ids in self.postings.items()}
+        self.norms = [math.sqrt(sum((count * self.idf[ngram]) ** 2 for ngram, count in ngrams.items()))
+                      for ngrams in self.documents]
+        self.stale = False
+
+    def classify(self, description: str, budget_categories: set[tuple[str, str]]) -> tuple[tuple[str, str], float]:
+        # returns the best (Category, Sub-Category) from the budget and a confidence between 0 and 1
+        if self.stale:
+            self.refresh_weights()
+        query = character_ngrams(normalise_description(description))
+        query_weights = {ngram: count * self.idf[ngram] for ngram, count in query.items() if ngram in self.idf}
+        query_norm = math.sqrt(sum(weight ** 2 for weight in query_weights.values()))
+        if query_norm == 0:
+            return None, 0.0
+
+        dot_products = {}
+        for ngram, query_weight in query_weights.items():
+            for document_id in self.postings[ngram]:
+                document_weight = self.documents[document_id][ngram] * self.idf[ngram]
+                dot_products[document_id] = dot_products.get(document_id, 0.0) + query_weight * document_weight
+        similarities = sorted(((dot_product / (query_norm * self.norms[document_id]), document_id)
+                               for document_id, dot_product in dot_products.items()), reverse=True)
+
+        # neighbours only vote for labels the effective budget still defines
+        votes = {}
+        neighbour_similarities = []
+        for similarity, document_id in similarities:
+            label_counts = {label: count for label, count in self.labels[self.descriptions[document_id]].items()
+                            if label in budget_categories}
+            if len(label_counts) == 0:
+                continue
+            label_total = sum(label_counts.values())
+            for label, count in label_counts.items():
+                votes[label] = votes.get(label, 0.0) + similarity * count / label_total
+            neighbour_similarities.append(similarity)
+            if len(neighbour_similarities) == NEIGHBOURS:
+                break
+        if len(votes) == 0:
+            return None, 0.0
+        best_label = max(votes, key=votes.get)
+        # agreement between neighbours scaled by how close the nearest neighbour is
+        return best_label, votes[best_label] / sum(neighbour_similarities) * neighbour_similarities[0]
@@ -0,0 +1,72 @@
+import contextlib
+import cProfile
+import json
+import logging
+import time
+
+logger = logging.getLogger("budget_planner")
+
+
+class Metrics:
+    # Collects per-stage wall time and counters for a run, optionally streaming every event as a JSON line
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+        self.sink = None
+
+    def open_sink(self, path: str) -> None:
+        self.sink = open(path, "a")
+
+    def close(self) -> None:
+        self.emit({"event": "summary", "stages": self.stages, "counters": self.counters})
+        if self.sink is not None:
+            self.sink.close()
+            self.sink = None
+
+    def emit(self, event: dict) -> None:
+        if self.sink is not None:
+            self.sink.write(json.dumps(event) + "\n")
+            self.sink.flush()
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            stage = self.stages.setdefault(name, {"calls": 0, "seconds": 0.0})
+            stage["calls"] = stage["calls"] + 1
+            stage["seconds"] = stage["seconds"] + seconds
+            self.emit({"event": "stage", "stage": name, "seconds": seconds})
+
+    def increment(self, name: str, amount: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def summary_table(self) -> str:
+        lines = ["{:<32}{:>8}{:>12}".format("stage", "calls", "seconds")]
+        for name, stage in self.stages.items():
+            lines.append("{:<32}{:>8}{:>12.4f}".format(name, stage["calls"], stage["seconds"]))
+        lines.append("")
+        lines.append("{:<32}{:>20}".format("counter", "value"))
+        for name, value in self.counters.items():
+            lines.append("{:<32}{:>20}".format(name, value))
+        return "\n".join(lines)
+
+
+metrics = Metrics()
+
+
+@contextlib.contextmanager
+def profiled(profile_file: str):
+    # wraps a block in cProfile when a file is given, the stats can be read with python -m pstats
+    if profile_file is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(profile_file)
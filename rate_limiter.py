@@ -0,0 +1,71 @@
+import asyncio
+import random
+import time
+
+
+class TokenBucket:
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.available = capacity
+        self.last_refill = time.monotonic()
+
+    def refill(self) -> None:
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.last_refill) * self.refill_per_second)
+        self.last_refill = now
+
+    def seconds_until_available(self, amount: float) -> float:
+        self.refill()
+        # a single request larger than the bucket would otherwise never be scheduled
+        amount = min(amount, self.capacity)
+        if self.available >= amount:
+            return 0
+        return (amount - self.available) / self.refill_per_second
+
+    def consume(self, amount: float) -> None:
+        self.available = self.available - min(amount, self.capacity)
+
+
+class RateLimitScheduler:
+    # Keeps requests and tokens under per-minute limits using two token buckets
+    # On a rate limit error the request rate is halved and all requests pause (multiplicative decrease), each
+    # success after that restores a fraction of the configured rate (additive increase)
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int, min_backoff_seconds: float = 1,
+                 max_backoff_seconds: float = 60):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.request_bucket = TokenBucket(requests_per_minute, requests_per_minute / 60)
+        self.token_bucket = TokenBucket(tokens_per_minute, tokens_per_minute / 60)
+        self.min_backoff_seconds = min_backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.consecutive_backoffs = 0
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, tokens: int) -> None:
+        async with self.lock:
+            while True:
+                wait = max(self.paused_until - time.monotonic(), self.request_bucket.seconds_until_available(1),
+                           self.token_bucket.seconds_until_available(tokens))
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            self.request_bucket.consume(1)
+            self.token_bucket.consume(tokens)
+
+    def backoff(self, retry_after: float = None) -> float:
+        self.consecutive_backoffs = self.consecutive_backoffs + 1
+        delay = min(self.max_backoff_seconds, self.min_backoff_seconds * 2 ** (self.consecutive_backoffs - 1))
+        delay = delay * (1 + random.random() / 4)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        self.paused_until = max(self.paused_until, time.monotonic() + delay)
+        self.request_bucket.refill_per_second = max(1 / 60, self.request_bucket.refill_per_second / 2)
+        return delay
+
+    def recover(self) -> None:
+        self.consecutive_backoffs = 0
+        full_rate = self.requests_per_minute / 60
+        self.request_bucket.refill_per_second = min(full_rate,
+                                                    self.request_bucket.refill_per_second + full_rate / 10)
@@ -1,99 +1,109 @@
 import csv
+import functools
+import os
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from stockholm import Money
-from mako.template import Template
+
+from ledger import cents_to_money
+from file_paths import REPORT_OUTPUT_DIR, REPORT_FILENAME_FORMAT, REPORT_TEMPLATE_FILE, REPORT_TEMPLATE_MODULE_DIR
+
+REPORT_FORMATS: list[str] = ["csv", "html"]
 
 rows_header: list[str] = ['Category', 'Sub-Category', 'Monthly Allocation (Budget)', 'Prev. Month Remainder',
-                          'Avail. Budget', 'Spend', 'Remainder', 'Next Month Avail.']
+                          'Avail. Budget', 'Spend', 'Remainder', 'Next Month Avail.', 'Flags']
+REPORT_AMOUNT_COLUMNS: list[str] = rows_header[2:-1]
+ZERO: Money = Money(0, "AUD")
 
 
 def prepare_report_rows(parsed_budget: dict, parsed_statement: dict, carry: dict, remainder: dict,
-                        remaining_spend: dict, next_month_available: dict) -> list[list[str]]:
+                        remaining_spend: dict, next_month_available: dict, category_totals: dict,
+                        flags: dict = None) -> list[list[str]]:
+    # category_totals holds each category's totals in cents in column order as computed by ledger.compute_months,
+    # flags maps (category, sub_category) to the habit flags shown in the last column
+    if flags is None:
+        flags = {}
     rows = []
-    complete_budget_total = Money(0, "AUD")
-    complete_spend_total = Money(0, "AUD")
-    complete_carry_total = Money(0, "AUD")
-    complete_remainder_total = Money(0, "AUD")
-    complete_remaining_spend_total = Money(0, "AUD")
-    complete_next_month_available_total = Money(0, "AUD")
+    complete_totals = [0] * len(REPORT_AMOUNT_COLUMNS)
     for category in parsed_budget:
-        category_budget = category_total(parsed_budget, category)
-        category_spend = category_total(parsed_statement, category)
-        category_carry = category_total(carry, category)
-        category_remainder = category_total(remainder, category)
-        category_remaining_spend = category_total(remaining_spend, category)
-        category_next_month_available = category_total(next_month_available, category)
-
-        complete_budget_total = complete_budget_total + category_budget
-        complete_spend_total = complete_spend_total + category_spend
-        complete_carry_total = complete_carry_total + category_carry
-        complete_remainder_total = complete_remainder_total + category_remainder
-        complete_remaining_spend_total = complete_remaining_spend_total + category_remaining_spend
-        complete_next_month_available_total = complete_next_month_available_total + category_next_month_available
-
-        category_row = [category, "", "", "", "", "", "", ""]
-        rows.append(category_row)
-
+        totals = category_totals[category]
+        complete_totals = [complete_total + total for complete_total, total in zip(complete_totals, totals)]
+        rows.append([category, "", "", "", "", "", "", "", ""])
         for sub_category in parsed_budget[category]:
-            sub_category_budget = Money(0, "AUD") if sub_category not in parsed_budget[category] else \
-                parsed_budget[category][sub_category]
-            sub_category_spend: Money = Money(0, "AUD") if category not in parsed_statement or sub_category not in \
-                                                           parsed_statement[category] else parsed_statement[category][
-                sub_category]
-            sub_category_carry: Money = Money(0, "AUD") if sub_category not in carry[category] else carry[category][
-                sub_category]
-            sub_category_remainder: Money = Money(0, "AUD") if sub_category not in remainder[category] else \
-                remainder[category][sub_category]
-            sub_category_remaining_spend: Money = Money(0, "AUD") if sub_category not in remaining_spend[category] else \
-                remaining_spend[category][sub_category]
-            sub_category_next_month_available: Money = Money(0, "AUD") if sub_category not in next_month_available[
-                category] else next_month_available[category][sub_category]
-            sub_category_row = ["", sub_category, sub_category_budget.amount_as_string(),
-                                sub_category_carry.amount_as_string(), sub_category_remaining_spend.amount_as_string(),
-                                sub_category_spend.amount_as_string(), sub_category_remainder.amount_as_string(),
-                                sub_category_next_month_available.amount_as_string()]
-            rows.append(sub_category_row)
-        totals_row = ["Total", "", category_budget.amount_as_string(), category_carry.amount_as_string(),
-                      category_remaining_spend.amount_as_string(), category_spend.amount_as_string(),
-                      category_remainder.amount_as_string(), category_next_month_available.amount_as_string()]
-        rows.append(totals_row)
-    complete_totals_row = ["Complete Total", "", complete_budget_total.amount_as_string(),
-                           complete_carry_total.amount_as_string(), complete_remaining_spend_total.amount_as_string(),
-                           complete_spend_total.amount_as_string(), complete_remainder_total.amount_as_string(),
-                           complete_next_month_available_total.amount_as_string()]
-    rows.append(complete_totals_row)
+            amounts = [parsed_budget[category][sub_category],
+                       sub_category_amount(carry, category, sub_category),
+                       sub_category_amount(remaining_spend, category, sub_category),
+                       sub_category_amount(parsed_statement, category, sub_category),
+                       sub_category_amount(remainder, category, sub_category),
+                       sub_category_amount(next_month_available, category, sub_category)]
+            rows.append(["", sub_category] + [amount.amount_as_string() for amount in amounts] +
+                        ["; ".join(flags.get((category, sub_category), []))])
+        rows.append(["Total", ""] + cents_as_strings(totals) + [""])
+    rows.append(["Complete Total", ""] + cents_as_strings(complete_totals) + [""])
     return rows
 
 
-def category_total(parsed_dict: dict, category_name: str) -> Money:
-    total = Money(0, "AUD")
-    if category_name not in parsed_dict:
-        return total
-    for sub_category in parsed_dict[category_name]:
-        total = total + parsed_dict[category_name][sub_category]
-    return total
+def sub_category_amount(parsed_dict: dict, category: str, sub_category: str) -> Money:
+    amount = parsed_dict.get(category, {}).get(sub_category)
+    return ZERO if amount is None else amount
+
+
+def cents_as_strings(totals: list[int]) -> list[str]:
+    return [cents_to_money(total).amount_as_string() for total in totals]
+
+
+def report_filename(statement_date: datetime, extension: str, output_dir: str = REPORT_OUTPUT_DIR,
+                    filename_format: str = REPORT_FILENAME_FORMAT) -> str:
+    # filename_format is a str.format pattern with {date} as YYYYMMDD and {extension}
+    return os.path.join(output_dir, filename_format.format(date=statement_date.strftime("%Y%m%d"),
+                                                           extension=extension))
 
 
-def render_csv(parsed_budget: dict, parsed_statement: dict, carry: dict, remainder: dict, remaining_spend: dict,
-               next_month_available: dict, statement_date: datetime) -> None:
-    report_rows = [rows_header.copy()]
-    for row in prepare_report_rows(parsed_budget, parsed_statement, carry, remainder, remaining_spend,
-                                   next_month_available):
-        report_rows.append(row)
-    filename = "report{}.csv".format(statement_date.strftime("%Y%m%d"))
+@functools.lru_cache()
+def report_template():
+    # compiled once per process, with a module directory the compiled template is also reused across runs
+    # Mako is only imported once an HTML report is rendered
+    from mako.template import Template
+    return Template(filename=REPORT_TEMPLATE_FILE, module_directory=REPORT_TEMPLATE_MODULE_DIR)
+
+
+def render_csv(report_rows: list[list[str]], statement_date: datetime, output_dir: str = REPORT_OUTPUT_DIR,
+               filename_format: str = REPORT_FILENAME_FORMAT) -> None:
+    filename = report_filename(statement_date, "csv", output_dir, filename_format)
     with open(filename, 'w') as file:
         writer = csv.writer(file)
-        for row in report_rows:
-            writer.writerow(row)
+        writer.writerow(rows_header)
+        writer.writerows(report_rows)
 
 
-def render_html(parsed_budget: dict, parsed_statement: dict, carry: dict, remainder: dict, remaining_spend: dict,
-                next_month_available: dict, statement_date: datetime) -> None:
-    report_rows = prepare_report_rows(parsed_budget, parsed_statement, carry, remainder, remaining_spend,
-                                      next_month_available)
+def render_html(report_rows: list[list[str]], statement_date: datetime, output_dir: str = REPORT_OUTPUT_DIR,
+                filename_format: str = REPORT_FILENAME_FORMAT) -> None:
     header = "Budget Spend " + statement_date.strftime("%B %Y")
-    filename = "report{}.html".format(statement_date.strftime("%Y%m%d"))
-    rendered_template = Template(filename='report_template.mako').render(rows=report_rows, header=header,
-                                                                         rows_header=rows_header)
+    filename = report_filename(statement_date, "html", output_dir, filename_format)
+    rendered_template = report_template().render(rows=report_rows, header=header, rows_header=rows_header)
     with open(filename, 'w') as file:
-        file.write(rendered_template)
\ No newline at end of file
+        file.write(rendered_template)
+
+
+def render_month(report_rows: list[list[str]], statement_date: datetime, output_dir: str,
+                 formats: list[str] = REPORT_FORMATS, filename_format: str = REPORT_FILENAME_FORMAT) -> None:
+    if "csv" in formats:
+        render_csv(report_rows, statement_date, output_dir, filename_format)
+    if "html" in formats:
+        render_html(report_rows, statement_date, output_dir, filename_format)
+
+
+def render_reports(monthly_report_rows: list[tuple[list[list[str]], datetime]], output_dir: str = REPORT_OUTPUT_DIR,
+                   max_workers: int = None, formats: list[str] = REPORT_FORMATS,
+                   filename_format: str = REPORT_FILENAME_FORMAT) -> None:
+    # each month is rendered independently so months are spread across a process pool
+    os.makedirs(output_dir, exist_ok=True)
+    if len(monthly_report_rows) <= 1 or max_workers == 1:
+        for report_rows, statement_date in monthly_report_rows:
+            render_month(report_rows, statement_date, output_dir, formats, filename_format)
+        return
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(render_month, report_rows, statement_date, output_dir, formats, filename_format)
+                   for report_rows, statement_date in monthly_report_rows]
+        for future in futures:
+            future.result()
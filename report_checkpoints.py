@@ -0,0 +1,76 @@
+import hashlib
+import json
+import os
+
+from stockholm import Money
+
+
+file_digest_cache: dict[str, tuple[tuple[int, int], str]] = {}
+
+
+def file_digest(path: str) -> str:
+    # memoised by modification time and size so long running processes only re-hash files that changed
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    cached = file_digest_cache.get(path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(65536), b""):
+            digest.update(block)
+    file_digest_cache[path] = (signature, digest.hexdigest())
+    return file_digest_cache[path][1]
+
+
+def checkpoint_key(previous_key: str, statement: str, budget_digest: str) -> str:
+    # chaining the previous month's key means a change to any input invalidates every month after it
+    return hashlib.sha256("{}:{}:{}".format(previous_key, file_digest(statement), budget_digest)
+                          .encode()).hexdigest()
+
+
+def serialise_remainder(remainder: dict) -> dict:
+    serialised = {}
+    for category in remainder:
+        serialised[category] = {}
+        for sub_category in remainder[category]:
+            serialised[category][sub_category] = remainder[category][sub_category].amount_as_string()
+    return serialised
+
+
+def deserialise_remainder(serialised: dict) -> dict:
+    remainder = {}
+    for category in serialised:
+        remainder[category] = {}
+        for sub_category in serialised[category]:
+            remainder[category][sub_category] = Money(serialised[category][sub_category], "AUD")
+    return remainder
+
+
+class ReportCheckpoints:
+    # Persists each month's remainder and habit tracker state keyed by a hash of every statement and budget up to and
+    # including that month
+    def __init__(self, checkpoint_file: str):
+        self.checkpoint_file = checkpoint_file
+        self.checkpoints = {}
+        if os.path.exists(checkpoint_file):
+            with open(checkpoint_file) as file:
+                self.checkpoints = json.load(file)
+
+    def is_current(self, month: str, key: str) -> bool:
+        return month in self.checkpoints and self.checkpoints[month]["key"] == key
+
+    def remainder(self, month: str) -> dict:
+        return deserialise_remainder(self.checkpoints[month]["remainder"])
+
+    def habits(self, month: str) -> dict:
+        return self.checkpoints[month].get("habits")
+
+    def update(self, month: str, key: str, remainder: dict, habits: dict = None) -> None:
+        self.checkpoints[month] = {"key": key, "remainder": serialise_remainder(remainder), "habits": habits}
+
+    def save(self) -> None:
+        temporary_file = self.checkpoint_file + ".tmp"
+        with open(temporary_file, "w") as file:
+            json.dump(self.checkpoints, file)
+        os.replace(temporary_file, self.checkpoint_file)
@@ -1,48 +1,387 @@
 #!/usr/bin/env python3
+import argparse
 import glob
+import logging
+import os
+import time
+from datetime import datetime
 
-from calculator import compute_carry, compute_remainder, compute_remaining_spend, \
-    compute_next_month_available_budget
-from budget_parser import parse_latest_valid_budget, parse_monthly_statement, parse_monthly_statement_date
-from renderer import render_csv, render_html
-from gpt_categoriser import categorise_statement
+from budget_parser import EXPORT_DATE_FORMAT, BudgetTimeline, cents_to_money_totals, month_end_date, \
+    parse_statement_export
+from renderer import REPORT_FORMATS, prepare_report_rows, render_reports, report_filename
+from habit_flags import HabitTracker, habit_settings_key, load_irregular_categories
+from ledger import cents_to_money, compute_months
+from metrics import logger, metrics, profiled
+from report_checkpoints import ReportCheckpoints, checkpoint_key
+from statement_ingestion import group_statements_by_month, parse_monthly_views
+from transaction_db import TransactionDatabase
+from watcher import DirectoryWatcher
 from file_paths import MONTHLY_BUDGET_DIR, MONTHLY_BUDGET_CSV_PATTERN, EXPENSES_STATEMENT_PRE_CATEGORISE_DIR, \
-    EXPENSES_STATEMENT_POST_CATEGORISE_DIR, EXPENSES_STATEMENT_CSV_PATTERN
+    EXPENSES_STATEMENT_POST_CATEGORISE_DIR, EXPENSES_STATEMENT_CSV_PATTERN, REPORT_CHECKPOINT_FILE, REPORT_OUTPUT_DIR, \
+    TRANSACTION_DATABASE_FILE, IRREGULAR_CATEGORIES_FILE, REPORT_FILENAME_FORMAT, CATEGORISATION_CACHE_FILE, \
+    LOCAL_CLASSIFIER_FILE
+
+
+def reports_exist(statement_date: datetime, output_dir: str, formats: list[str] = REPORT_FORMATS,
+                  filename_format: str = REPORT_FILENAME_FORMAT) -> bool:
+    return all(os.path.exists(report_filename(statement_date, extension, output_dir, filename_format))
+               for extension in formats)
+
+
+def report_month(value: str) -> str:
+    # argparse type for --from and --to, months are compared as YYYY-MM strings
+    try:
+        return datetime.strptime(value, "%Y-%m").strftime("%Y-%m")
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected a month as YYYY-MM, got {}".format(value))
+
+
+def report_filename_format(value: str) -> str:
+    # argparse type for --filename-format, every month and format needs its own file in the output directory
+    try:
+        names = {value.format(date=date, extension=extension) for date in ["20230131", "20230228"]
+                 for extension in REPORT_FORMATS}
+    except (KeyError, IndexError, ValueError):
+        raise argparse.ArgumentTypeError("only {{date}} and {{extension}} can be used, got {}".format(value))
+    if len(names) != 2 * len(REPORT_FORMATS) or any(os.sep in name for name in names):
+        raise argparse.ArgumentTypeError("expected a file name using both {{date}} and {{extension}}, got {}"
+                                         .format(value))
+    return value
+
+
+def generate_reports(budget_timeline: BudgetTimeline, categorised_statements: list[str], force: bool = False,
+                     output_dir: str = REPORT_OUTPUT_DIR, max_workers: int = None,
+                     checkpoints: ReportCheckpoints = None, formats: list[str] = REPORT_FORMATS,
+                     from_month: str = None, to_month: str = None, database: TransactionDatabase = None,
+                     filename_format: str = REPORT_FILENAME_FORMAT) -> None:
+    # Statements are grouped by month so every account of a month is merged into one report, months run in
+    # chronological order through the carry chain whatever order the files were listed in
+    # with a synced database the budgets and monthly spend come from SQL aggregates instead of the CSV files
+    monthly_statements = group_statements_by_month(categorised_statements)
+    if to_month is not None:
+        monthly_statements = {month: statements for month, statements in monthly_statements.items()
+                              if month <= to_month}
+
+    def load_monthly_views(stale_months: list[str]) -> dict[str, dict]:
+        if database is None:
+            return parse_monthly_views({month: monthly_statements[month] for month in stale_months}, max_workers)
+        if len(stale_months) == 0:
+            return {}
+        return database.monthly_statements(stale_months[0], stale_months[-1])
+
+    report_months(budget_timeline, monthly_statements, load_monthly_views, force, output_dir, max_workers,
+                  checkpoints, formats, from_month, database, filename_format)
 
-if __name__ == "__main__":
-    monthly_budgets: list[str] = glob.glob(MONTHLY_BUDGET_DIR + MONTHLY_BUDGET_CSV_PATTERN)
 
-    uncategorised_monthly_expenses: list[str] = glob.glob(
-        "{0}{1}".format(EXPENSES_STATEMENT_PRE_CATEGORISE_DIR, EXPENSES_STATEMENT_CSV_PATTERN))
+def generate_export_reports(budget_timeline: BudgetTimeline, export_file: str, date_format: str = EXPORT_DATE_FORMAT,
+                            force: bool = False, output_dir: str = REPORT_OUTPUT_DIR, max_workers: int = None,
+                            checkpoints: ReportCheckpoints = None, formats: list[str] = REPORT_FORMATS,
+                            from_month: str = None, to_month: str = None,
+                            filename_format: str = REPORT_FILENAME_FORMAT) -> None:
+    # Reports every month of a categorised multi-month export, split on its Date column. Every month depends on the
+    # whole export so any change to it recomputes them all
+    with metrics.stage("parse_export"):
+        monthly_totals = parse_statement_export(export_file, date_format)
+    if to_month is not None:
+        monthly_totals = {month: totals for month, totals in monthly_totals.items() if month <= to_month}
+    report_months(budget_timeline, {month: [export_file] for month in monthly_totals},
+                  lambda stale_months: {month: cents_to_money_totals(monthly_totals[month]) for month in stale_months},
+                  force, output_dir, max_workers, checkpoints, formats, from_month, None, filename_format)
+
+
+def report_months(budget_timeline: BudgetTimeline, month_inputs: dict[str, list[str]], load_monthly_views,
+                  force: bool, output_dir: str, max_workers: int, checkpoints: ReportCheckpoints,
+                  formats: list[str], from_month: str, database: TransactionDatabase = None,
+                  filename_format: str = REPORT_FILENAME_FORMAT) -> None:
+    # month_inputs maps each "YYYY-MM" month in chronological order to the files its spend is read from,
+    # load_monthly_views returns the parse_monthly_statement shaped spend of the given months
+    # months before from_month are still computed when stale so the carry into the range is right but they are
+    # not rendered
+    if checkpoints is None:
+        checkpoints = ReportCheckpoints(REPORT_CHECKPOINT_FILE)
+
+    months = list(month_inputs)
+    month_dates = list(map(month_end_date, months))
+    in_range = [from_month is None or month >= from_month for month in months]
+    irregular_categories = load_irregular_categories(IRREGULAR_CATEGORIES_FILE)
+    keys = []
+    # the chain starts from the habit flag settings so changing them re-renders every report
+    previous_key = habit_settings_key(irregular_categories)
+    for month_date, inputs in zip(month_dates, month_inputs.values()):
+        budget_digest = budget_timeline.parsed_budget_on(month_date).digest
+        for input_file in inputs:
+            previous_key = checkpoint_key(previous_key, input_file, budget_digest)
+        keys.append(previous_key)
+    up_to_date = [not force and checkpoints.is_current(month, key) and
+                  (not rendered or reports_exist(month_date, output_dir, formats, filename_format))
+                  for month_date, month, key, rendered in zip(month_dates, months, keys, in_range)]
+
+    # resume from the earliest month whose inputs changed, carrying the remainder and habit tracker state
+    # checkpointed before it
+    first_stale = up_to_date.index(False) if False in up_to_date else len(months)
+    initial_remainder = None if first_stale == 0 else checkpoints.remainder(months[first_stale - 1])
+    habit_tracker = HabitTracker(irregular_categories,
+                                 None if first_stale == 0 else checkpoints.habits(months[first_stale - 1]))
+    stale_months = months[first_stale:]
+    # Parse budget and expenses step
+    with metrics.stage("parse_budgets"):
+        if database is None:
+            parsed_budgets = [budget_timeline.parsed_budget_on(month_date).as_dict()
+                              for month_date in month_dates[first_stale:]]
+        else:
+            parsed_budgets = [database.budget(budget_timeline.effective_budget_on(month_date))
+                              for month_date in month_dates[first_stale:]]
+    with metrics.stage("parse_statements"):
+        monthly_views = load_monthly_views(stale_months)
+        parsed_statements = [monthly_views.get(month, {}) for month in stale_months]
+    # Compute spend step, every stale month in one batched pass
+    with metrics.stage("compute_months"):
+        computed_months = compute_months(parsed_budgets, parsed_statements, initial_remainder)
+    monthly_report_rows = []
+    with metrics.stage("prepare_report_rows"):
+        for month_date, month, key, skip_render, rendered, parsed_budget, parsed_statement, computed_month in \
+                zip(month_dates[first_stale:], stale_months, keys[first_stale:], up_to_date[first_stale:],
+                    in_range[first_stale:], parsed_budgets, parsed_statements, computed_months):
+            carry, remainder, remaining_spend, next_month_available, category_totals = computed_month
+            flags = habit_tracker.update(parsed_budget, parsed_statement, remainder)
+            checkpoints.update(month, key, remainder, habit_tracker.state())
+            if skip_render or not rendered:
+                continue
+            report_rows = prepare_report_rows(parsed_budget, parsed_statement, carry, remainder, remaining_spend,
+                                              next_month_available, category_totals, flags)
+            monthly_report_rows.append((report_rows, month_date))
+    # Render report step
+    with metrics.stage("render_reports"):
+        render_reports(monthly_report_rows, output_dir, max_workers, formats, filename_format)
+    metrics.increment("months_skipped", len(months) - len(monthly_report_rows))
+    metrics.increment("reports_rendered", len(monthly_report_rows))
+    checkpoints.save()
+
+
+def matching_files(pattern: str, settled: dict = None) -> list[str]:
+    # with the watcher's settled set, files still being written are left for a later run
+    files = glob.glob(pattern)
+    return files if settled is None else [file for file in files if file in settled]
+
+
+def categorise_pending(budget_timeline: BudgetTimeline, settled: dict = None, cache=None,
+                       classifier=None) -> list[str]:
+    # the categoriser pulls in the API client and tokenizer so it is only imported when there is work for it
+    # returns the post-categorise files written, cache and classifier are kept warm by watch
+    uncategorised_monthly_expenses: list[str] = matching_files(
+        "{0}{1}".format(EXPENSES_STATEMENT_PRE_CATEGORISE_DIR, EXPENSES_STATEMENT_CSV_PATTERN), settled)
     categorised_monthly_expenses: list[str] = glob.glob(
         "{0}{1}".format(EXPENSES_STATEMENT_POST_CATEGORISE_DIR, EXPENSES_STATEMENT_CSV_PATTERN))
 
-    carry = None
-    remainder = None
-
     categorised_statement_files = list(
         map(lambda categorised_statement: categorised_statement[len(EXPENSES_STATEMENT_POST_CATEGORISE_DIR):],
             categorised_monthly_expenses))
 
+    pending_statements = []
     for statement in uncategorised_monthly_expenses:
         uncategorised_statement = statement[len(EXPENSES_STATEMENT_PRE_CATEGORISE_DIR):]
         if uncategorised_statement not in categorised_statement_files:
-            categorise_statement(monthly_budgets, statement)
-
-# TODO: wait for async operations -- writing file has IO delay which needs to be factored in
-
-    for statement in categorised_monthly_expenses:
-        # Parse budget and expenses step
-        parsed_budget = parse_latest_valid_budget(monthly_budgets, statement)
-        parsed_statement = parse_monthly_statement(statement)
-        statement_date = parse_monthly_statement_date(statement)
-        # Compute spend step
-        carry = compute_carry(remainder, parsed_budget)
-        remainder = compute_remainder(carry, parsed_budget, parsed_statement)
-        remaining_spend = compute_remaining_spend(carry, parsed_budget)
-        next_month_available = compute_next_month_available_budget(remainder, parsed_budget)
-        # Render report step
-        render_csv(parsed_budget, parsed_statement, carry, remainder, remaining_spend, next_month_available,
-                   statement_date)
-        render_html(parsed_budget, parsed_statement, carry, remainder, remaining_spend, next_month_available,
-                    statement_date)
+            pending_statements.append(statement)
+    if len(pending_statements) == 0:
+        return []
+    from gpt_categoriser import categorise_statements
+    return categorise_statements(budget_timeline, pending_statements, cache=cache, classifier=classifier)
+
+
+def load_budget_timeline(settled: dict = None) -> BudgetTimeline:
+    monthly_budgets: list[str] = matching_files(MONTHLY_BUDGET_DIR + MONTHLY_BUDGET_CSV_PATTERN, settled)
+    return BudgetTimeline(monthly_budgets)
+
+
+def run(force: bool, output_dir: str, max_workers: int, checkpoints: ReportCheckpoints = None,
+        formats: list[str] = REPORT_FORMATS, from_month: str = None, to_month: str = None,
+        categorise: bool = True, database_file: str = None, filename_format: str = REPORT_FILENAME_FORMAT,
+        settled: dict = None, cache=None, classifier=None) -> list[str]:
+    # settled limits the run to those budget and statement files, returns the post-categorise files it wrote
+    budget_timeline = load_budget_timeline(settled)
+    categorised_files = categorise_pending(budget_timeline, settled, cache, classifier) if categorise else []
+    # categorised statements are globbed after categorisation so statements written in this run are reported
+    categorised_monthly_expenses: list[str] = matching_files(
+        "{0}{1}".format(EXPENSES_STATEMENT_POST_CATEGORISE_DIR, EXPENSES_STATEMENT_CSV_PATTERN), settled)
+    categorised_monthly_expenses = categorised_monthly_expenses + [
+        categorised_file for categorised_file in categorised_files
+        if categorised_file not in categorised_monthly_expenses]
+    database = None
+    if database_file is not None:
+        database = TransactionDatabase(database_file)
+        database.sync(budget_timeline.budgets, categorised_monthly_expenses)
+    try:
+        generate_reports(budget_timeline, categorised_monthly_expenses, force, output_dir, max_workers, checkpoints,
+                         formats, from_month, to_month, database, filename_format)
+    finally:
+        if database is not None:
+            database.close()
+    return categorised_files
+
+
+def report_export(export_file: str, date_format: str, force: bool, output_dir: str, max_workers: int,
+                  formats: list[str] = REPORT_FORMATS, from_month: str = None, to_month: str = None,
+                  filename_format: str = REPORT_FILENAME_FORMAT) -> None:
+    generate_export_reports(load_budget_timeline(), export_file, date_format, force, output_dir, max_workers, None,
+                            formats, from_month, to_month, filename_format)
+
+
+def spend(database_file: str, category: str, sub_category: str = None, from_month: str = None,
+          to_month: str = None) -> None:
+    # prints the monthly spend of a category over a range of months from the database
+    categorised_monthly_expenses: list[str] = glob.glob(
+        "{0}{1}".format(EXPENSES_STATEMENT_POST_CATEGORISE_DIR, EXPENSES_STATEMENT_CSV_PATTERN))
+    database = TransactionDatabase(database_file)
+    try:
+        database.sync(load_budget_timeline().budgets, categorised_monthly_expenses)
+        monthly_spend = database.spend_by_month(category, sub_category, from_month, to_month)
+    finally:
+        database.close()
+    for month, total_cents in monthly_spend.items():
+        print("{}{:>14}".format(month, cents_to_money(total_cents).amount_as_string()))
+    print("{}{:>14}".format("Total  ", cents_to_money(sum(monthly_spend.values())).amount_as_string()))
+
+
+def watch(output_dir: str, poll_interval: float, settle_seconds: float, formats: list[str] = REPORT_FORMATS,
+          filename_format: str = REPORT_FILENAME_FORMAT) -> None:
+    # Long running mode, state stays warm between changes: budgets are memoised by load_budget, the tokenizer and
+    # compiled template live for the whole process, the categorisation cache and local classifier are loaded once
+    # and only learn from new statements, and checkpoints stay in memory so only months downstream of a change are
+    # recomputed
+    from categorisation_cache import CategorisationCache
+    from local_classifier import LocalClassifier
+    watcher = DirectoryWatcher([MONTHLY_BUDGET_DIR + MONTHLY_BUDGET_CSV_PATTERN,
+                                EXPENSES_STATEMENT_PRE_CATEGORISE_DIR + EXPENSES_STATEMENT_CSV_PATTERN,
+                                EXPENSES_STATEMENT_POST_CATEGORISE_DIR + EXPENSES_STATEMENT_CSV_PATTERN],
+                               settle_seconds)
+    checkpoints = ReportCheckpoints(REPORT_CHECKPOINT_FILE)
+    cache = CategorisationCache(CATEGORISATION_CACHE_FILE)
+    classifier = LocalClassifier(LOCAL_CLASSIFIER_FILE)
+    run(False, output_dir, 1, checkpoints, formats, filename_format=filename_format, cache=cache,
+        classifier=classifier)
+    watcher.mark_processed()
+    logger.info("watching for new statements")
+    while True:
+        time.sleep(poll_interval)
+        changed_files = watcher.poll()
+        if len(changed_files) == 0:
+            continue
+        logger.info("changed: %s", ", ".join(changed_files))
+        start = time.perf_counter()
+        # only files that have settled are read, files still being written are picked up by a later event
+        settled = watcher.settled(changed_files)
+        categorised_files = []
+        try:
+            # rendering in process keeps the compiled template warm, only a few months change per event
+            categorised_files = run(False, output_dir, 1, checkpoints, formats, filename_format=filename_format,
+                                    settled=settled, cache=cache, classifier=classifier)
+        except Exception:
+            logger.exception("failed to process changes")
+        # files are marked with the signature they were read with so one modified during the run is processed
+        # again, statements this run categorised are already reported and must not trigger another run
+        watcher.mark_processed(changed_files, settled)
+        watcher.mark_processed(categorised_files)
+        logger.info("processed in %.2fs", time.perf_counter() - start)
+
+
+def main(args: argparse.Namespace) -> None:
+    if args.command == "categorise":
+        categorise_pending(load_budget_timeline())
+    elif args.command == "watch":
+        watch(args.output_dir, args.poll_interval, args.settle_seconds, args.formats, args.filename_format)
+    elif args.command == "spend":
+        spend(args.database, args.category, args.sub_category, args.from_month, args.to_month)
+    elif args.export is not None:
+        if args.database is not None:
+            raise Exception("--export reads the export file directly and cannot be combined with --database!")
+        report_export(args.export, args.date_format, args.force, args.output_dir, args.workers, args.formats,
+                      args.from_month, args.to_month, args.filename_format)
+    else:
+        run(args.force, args.output_dir, args.workers, None, args.formats, args.from_month, args.to_month,
+            args.command != "report", args.database, args.filename_format)
+
+
+def add_diagnostic_options(parser: argparse.ArgumentParser, default=None) -> None:
+    # accepted before or after the command, the command's copies use SUPPRESS so they don't overwrite the values
+    # given before it
+    parser.add_argument("--log-level", default=default or "INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                        help="DEBUG also logs full prompts and responses")
+    parser.add_argument("--metrics-file", default=default, help="append stage timings and API usage as JSON lines")
+    parser.add_argument("--metrics-summary", action="store_true", default=default or False,
+                        help="print a table of stage timings at the end")
+    parser.add_argument("--profile", default=default, help="write cProfile stats for the run to this file")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Categorise statements and generate monthly budget reports, "
+                                                 "with no command both are run")
+    add_diagnostic_options(parser)
+    parser.set_defaults(command=None, force=False, output_dir=REPORT_OUTPUT_DIR, workers=None, formats=REPORT_FORMATS,
+                        from_month=None, to_month=None, database=None, export=None,
+                        filename_format=REPORT_FILENAME_FORMAT)
+
+    diagnostic_options = argparse.ArgumentParser(add_help=False)
+    add_diagnostic_options(diagnostic_options, argparse.SUPPRESS)
+    output_options = argparse.ArgumentParser(add_help=False, parents=[diagnostic_options])
+    output_options.add_argument("--output-dir", default=REPORT_OUTPUT_DIR, help="directory reports are written to")
+    output_options.add_argument("--filename-format", type=report_filename_format, default=REPORT_FILENAME_FORMAT,
+                                help="report file names with {{date}} as YYYYMMDD and {{extension}}, {} by default"
+                                .format(REPORT_FILENAME_FORMAT))
+    output_options.add_argument("--formats", nargs="+", choices=REPORT_FORMATS, default=REPORT_FORMATS,
+                                help="report formats to render")
+    report_options = argparse.ArgumentParser(add_help=False, parents=[output_options])
+    report_options.add_argument("--force", action="store_true", help="ignore checkpoints and rebuild every report")
+    report_options.add_argument("--workers", type=int, default=None,
+                                help="processes used to parse statements and render reports")
+    report_options.add_argument("--from", dest="from_month", type=report_month, default=None,
+                                help="first month to render as YYYY-MM, earlier months only feed the carry")
+    report_options.add_argument("--to", dest="to_month", type=report_month, default=None,
+                                help="last month to render as YYYY-MM")
+    report_options.add_argument("--database", nargs="?", const=TRANSACTION_DATABASE_FILE, default=None,
+                                help="sync categorised statements and budgets into this SQLite ledger and report "
+                                     "from it, defaults to {} when given without a path"
+                                .format(TRANSACTION_DATABASE_FILE))
+
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("categorise", parents=[diagnostic_options],
+                        help="categorise statements that have no post-categorise file yet")
+    report_parser = commands.add_parser("report", parents=[report_options],
+                                        help="generate reports from categorised statements only")
+    report_parser.add_argument("--export", default=None,
+                               help="report every month of this categorised multi-month export instead of the "
+                                    "post-categorise statements")
+    report_parser.add_argument("--date-format", default=EXPORT_DATE_FORMAT,
+                               help="strptime format of the export's Date column, {} by default"
+                               .format(EXPORT_DATE_FORMAT.replace("%", "%%")))
+    commands.add_parser("run", parents=[report_options], help="categorise pending statements then generate reports")
+    spend_parser = commands.add_parser("spend", parents=[diagnostic_options],
+                                       help="print monthly spend of a category from the SQLite ledger")
+    spend_parser.add_argument("--category", required=True)
+    spend_parser.add_argument("--sub-category", default=None)
+    spend_parser.add_argument("--from", dest="from_month", type=report_month, default=None, help="YYYY-MM")
+    spend_parser.add_argument("--to", dest="to_month", type=report_month, default=None, help="YYYY-MM")
+    spend_parser.add_argument("--database", nargs="?", const=TRANSACTION_DATABASE_FILE,
+                              default=TRANSACTION_DATABASE_FILE,
+                              help="SQLite ledger to sync and query, defaults to {} when not given or given without "
+                                   "a path".format(TRANSACTION_DATABASE_FILE))
+    watch_parser = commands.add_parser("watch", parents=[output_options],
+                                       help="keep running and process statements as they land")
+    watch_parser.add_argument("--poll-interval", type=float, default=1, help="seconds between checks")
+    watch_parser.add_argument("--settle-seconds", type=float, default=2,
+                              help="seconds a file must be unchanged before it is processed")
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+
+    # only this tool's logger follows --log-level, third party libraries stay at warnings
+    logging.basicConfig(level=logging.WARNING, format="%(message)s")
+    logger.setLevel(args.log_level)
+    if args.metrics_file is not None:
+        metrics.open_sink(args.metrics_file)
+    with profiled(args.profile), metrics.stage("total"):
+        main(args)
+    metrics.close()
+    if args.metrics_summary:
+        print(metrics.summary_table())
@@ -14,6 +14,9 @@ th {
 .bold {
     font-weight: bold;
 }
+.flagged {
+    background-color: #FFE8B0;
+}
 </style>
 <h1>${header}</h1>
 
@@ -31,7 +34,7 @@ th {
         weight_modifier = ""
         if row[0] == "Total" or row[0] == "Complete Total":
             weight_modifier = "bold"
-        if index > 2 and index != 5:
+        if index > 2 and index != 5 and index != 8:
             if name != "" and float(name) > 0:
                 colour_modifier = "positive"
             elif name != "" and float(name) < 0:
@@ -43,6 +46,8 @@ th {
 <%def name="makerow(row, header)">
     % if row[0] == "Total" or row[0] == "Complete Total" or header:
         <tr style="border: 1px solid black">
+    % elif row[8] != "":
+        <tr class="flagged">
     % else:
         <tr>
     % endif
@@ -0,0 +1,50 @@
+from concurrent.futures import ProcessPoolExecutor
+
+from budget_parser import cents_to_money_totals, parse_monthly_statement_date, parse_statement_account, \
+    parse_statement_totals
+from metrics import metrics
+
+
+def statement_month(statement: str) -> str:
+    return parse_monthly_statement_date(statement).strftime("%Y-%m")
+
+
+def group_statements_by_month(statements: list[str]) -> dict[str, list[str]]:
+    # "YYYY-MM" to that month's statements in chronological order, statements within a month are ordered by account
+    # so results never depend on the order the filesystem lists them in
+    monthly_statements = {}
+    for statement in sorted(statements, key=lambda statement: (statement_month(statement),
+                                                               parse_statement_account(statement), statement)):
+        monthly_statements.setdefault(statement_month(statement), []).append(statement)
+    return monthly_statements
+
+
+def merge_totals(statement_totals: list[dict]) -> dict:
+    # sums per-category totals in cents from every account of a month
+    merged = {}
+    for totals in statement_totals:
+        for category in totals:
+            merged_category = merged.setdefault(category, {})
+            for sub_category, cents in totals[category].items():
+                merged_category[sub_category] = merged_category.get(sub_category, 0) + cents
+    return merged
+
+
+def parse_monthly_views(monthly_statements: dict[str, list[str]], max_workers: int = None) -> dict[str, dict]:
+    # Parses every statement across a process pool and merges each month's accounts into one view in the same shape
+    # as parse_monthly_statement, months are returned in the order given
+    statements = [statement for month_statements in monthly_statements.values() for statement in month_statements]
+    if len(statements) <= 1 or max_workers == 1:
+        parsed = list(map(parse_statement_totals, statements))
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            parsed = list(executor.map(parse_statement_totals, statements, chunksize=4))
+    metrics.increment("rows_parsed", sum(map(lambda statement_parsed: statement_parsed[1], parsed)))
+
+    monthly_views = {}
+    offset = 0
+    for month, month_statements in monthly_statements.items():
+        month_totals = [totals for totals, _ in parsed[offset:offset + len(month_statements)]]
+        offset = offset + len(month_statements)
+        monthly_views[month] = cents_to_money_totals(merge_totals(month_totals))
+    return monthly_views
@@ -0,0 +1,97 @@
+import csv
+import os
+import random
+from datetime import datetime
+
+from dateutil.relativedelta import relativedelta
+
+from file_paths import EXPENSES_STATEMENT_PRE_CATEGORISE_DIR, EXPENSES_STATEMENT_POST_CATEGORISE_DIR
+
+MERCHANT_WORDS: list[str] = ["WOOLWORTHS", "COLES", "ALDI", "BP", "SHELL", "NETFLIX", "SPOTIFY", "UBER", "KMART",
+                             "BUNNINGS", "TELSTRA", "AGL", "CHEMIST", "CAFE", "PIZZA", "CINEMA", "GYM", "PHARMACY"]
+SUBURBS: list[str] = ["SYDNEY", "MELBOURNE", "BRISBANE", "PERTH", "ADELAIDE", "HOBART"]
+
+
+def synthetic_categories(categories: int, sub_categories_per_category: int) -> list[tuple[str, str]]:
+    return [("Category{}".format(category), "Sub-Category{}-{}".format(category, sub_category))
+            for category in range(categories) for sub_category in range(sub_categories_per_category)]
+
+
+def synthetic_merchants(category_pairs: list[tuple[str, str]], rng: random.Random) -> list[tuple[str, tuple]]:
+    # a few merchants per sub-category so descriptions repeat from month to month like a real statement
+    merchants = []
+    for pair in category_pairs:
+        for _ in range(3):
+            merchants.append(("{} {}".format(rng.choice(MERCHANT_WORDS), rng.randint(1, 999)), pair))
+    return merchants
+
+
+def write_budget(path: str, category_pairs: list[tuple[str, str]], rng: random.Random) -> None:
+    with open(path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["Category", "Sub-Category", "Budget", "Ignore"])
+        for category, sub_category in category_pairs:
+            writer.writerow([category, sub_category, rng.randint(10, 1000), 0])
+
+
+def write_statement(pre_categorise_path: str, post_categorise_path: str, month: datetime,
+                    merchants: list[tuple[str, tuple]], transactions: int, rng: random.Random) -> None:
+    days_in_month = ((month + relativedelta(months=1)) - month).days
+    balance = 10000
+    with open(pre_categorise_path, "w", newline="") as pre_file, open(post_categorise_path, "w", newline="") as \
+            post_file:
+        pre_writer = csv.writer(pre_file)
+        post_writer = csv.writer(post_file)
+        pre_writer.writerow(["Date", "Description", "Debit", "Credit", "Balance"])
+        post_writer.writerow(["Date", "Description", "Debit", "Credit", "Balance", "Category", "Sub-Category"])
+        for day in sorted(rng.randint(1, days_in_month) for _ in range(transactions)):
+            date = month.replace(day=day).strftime("%d/%m/%Y")
+            merchant, (category, sub_category) = rng.choice(merchants)
+            description = "{} {} AU Card xx{:04d} Value Date: {}".format(merchant, rng.choice(SUBURBS),
+                                                                        rng.randint(0, 9999), date)
+            if rng.random() < 0.05:
+                amount = rng.randint(100, 300000)
+                balance = balance + amount / 100
+                row = [date, description, "", "${:,.2f}".format(amount / 100), "${:,.2f}".format(balance)]
+            else:
+                amount = rng.randint(100, 30000)
+                balance = balance - amount / 100
+                row = [date, description, "${:,.2f}".format(amount / 100), "", "${:,.2f}".format(balance)]
+            pre_writer.writerow(row)
+            post_writer.writerow(row + [category, sub_category])
+
+
+def generate_dataset(directory: str, months: int = 12, categories: int = 10, sub_categories_per_category: int = 4,
+                     transactions_per_month: int = 200, accounts: int = 1, seed: int = 0) -> dict:
+    # Writes a budget dated before the first month plus pre- and post-categorise statements for every
+    # (account, month) using the names expected by file_paths, returns the paths written
+    rng = random.Random(seed)
+    pre_categorise_dir = os.path.join(directory, EXPENSES_STATEMENT_PRE_CATEGORISE_DIR)
+    post_categorise_dir = os.path.join(directory, EXPENSES_STATEMENT_POST_CATEGORISE_DIR)
+    os.makedirs(pre_categorise_dir, exist_ok=True)
+    os.makedirs(post_categorise_dir, exist_ok=True)
+
+    category_pairs = synthetic_categories(categories, sub_categories_per_category)
+    merchants = synthetic_merchants(category_pairs, rng)
+    first_month = datetime(2020, 1, 1)
+    budget = os.path.join(directory, "monthly_budget{}.csv".format((first_month - relativedelta(days=1))
+                                                                   .strftime("%Y%m%d")))
+    write_budget(budget, category_pairs, rng)
+
+    pre_categorise_statements = []
+    post_categorise_statements = []
+    for month_offset in range(months):
+        month = first_month + relativedelta(months=month_offset)
+        for account in range(accounts):
+            # the first account uses the documented "_" form and any others the "-" form, both are accepted
+            file_name = "SpendAccountX{:02d}{}{}.csv".format(account + 1, "_" if account == 0 else "-",
+                                                            month.strftime("%Y-%m"))
+            pre_categorise_statements.append(os.path.join(pre_categorise_dir, file_name))
+            post_categorise_statements.append(os.path.join(post_categorise_dir, file_name))
+            write_statement(pre_categorise_statements[-1], post_categorise_statements[-1], month, merchants,
+                            transactions_per_month, rng)
+    return {
+        "budgets": [budget],
+        "pre_categorise_statements": pre_categorise_statements,
+        "post_categorise_statements": post_categorise_statements
+    }
@@ -0,0 +1,92 @@
+import csv
+
+import pytest
+from stockholm import Money
+
+from budget_parser import parse_monthly_statement, parse_monthly_statement_date, parse_statement_account
+
+
+def parse_monthly_statement_money(statement: str) -> dict:
+    # the Money based parser parse_monthly_statement replaced, kept as the reference its totals must match
+    parsed_statement = {}
+    with open(statement) as file:
+        reader = csv.reader(file)
+        header_row = next(reader)
+        debit_index = header_row.index("Debit")
+        credit_index = header_row.index("Credit")
+        category_index = header_row.index("Category")
+        sub_category_index = header_row.index("Sub-Category")
+        for row in reader:
+            normalised_debit = row[debit_index].replace("$", "").replace(",", "")
+            normalised_credit = row[credit_index].replace("$", "").replace(",", "")
+            missing_debit = normalised_debit == "" or normalised_debit == "-"
+            missing_credit = normalised_credit == "" or normalised_credit == "-"
+            category_exists = row[category_index] != "" and row[category_index] != "-"
+            sub_category_exists = row[sub_category_index] != "" and row[sub_category_index] != "-"
+            credit_with_category = not missing_credit and category_exists and sub_category_exists
+            if missing_debit and not credit_with_category:
+                continue
+            applied_amount = Money(normalised_debit, "AUD") if not missing_debit else \
+                -Money(normalised_credit, "AUD")
+            category_name = "Uncategorised" if not category_exists else row[category_index]
+            sub_category_name = "Uncategorised" if not sub_category_exists else row[sub_category_index]
+            category = parsed_statement.setdefault(category_name, {})
+            category[sub_category_name] = category[sub_category_name] + applied_amount \
+                if sub_category_name in category else applied_amount
+    return parsed_statement
+
+
+def write_statement(path, rows: list[list[str]]) -> str:
+    with open(path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["Date", "Description", "Debit", "Credit", "Balance", "Category", "Sub-Category"])
+        writer.writerows(rows)
+    return str(path)
+
+
+def test_matches_money_parser(tmp_path):
+    statement = write_statement(tmp_path / "SpendAccount1-2023-02.csv", [
+        ["01/02/2023", "Groceries", "$12.50", "", "$100.00", "Food", "Groceries"],
+        ["02/02/2023", "Groceries again", "1,234.5", "", "$1.00", "Food", "Groceries"],
+        ["03/02/2023", "Refund", "", "$20.00", "$1.00", "Food", "Groceries"],
+        ["03/02/2023", "Refund with a dash debit", "-", "$5", "$1.00", "Food", "Takeaway"],
+        ["04/02/2023", "Negative debit", "-$3.07", "", "$1.00", "Food", "Takeaway"],
+        ["05/02/2023", "Uncategorised debit", "$40.00", "", "$1.00", "", ""],
+        ["05/02/2023", "Dash categories", "$1,000.01", "", "$1.00", "-", "-"],
+        ["06/02/2023", "Category without sub-category", "$7", "", "$1.00", "Bills", ""],
+        ["07/02/2023", "Uncategorised credit is skipped", "", "$500.00", "$1.00", "", ""],
+        ["07/02/2023", "Credit missing a sub-category is skipped", "", "$9.99", "$1.00", "Bills", "-"],
+        ["08/02/2023", "No amounts", "", "", "$1.00", "Food", "Groceries"],
+        ["08/02/2023", "Dash amounts", "-", "-", "$1.00", "Food", "Groceries"],
+        ["09/02/2023", "Debit wins over credit", "$2.00", "$3.00", "$1.00", "Bills", "Power"],
+        ["10/02/2023", "Zero", "$0.00", "", "$1.00", "Bills", "Power"],
+    ])
+    parsed = parse_monthly_statement(statement)
+    expected = parse_monthly_statement_money(statement)
+    assert parsed == expected
+    # same categories in the same order with the same amounts to the cent
+    assert [(category, sub_category, amount.amount_as_string()) for category in parsed
+            for sub_category, amount in parsed[category].items()] == \
+        [(category, sub_category, amount.amount_as_string()) for category in expected
+         for sub_category, amount in expected[category].items()]
+
+
+def test_sub_cent_amounts_are_rejected(tmp_path):
+    statement = write_statement(tmp_path / "SpendAccount1-2023-02.csv", [
+        ["01/02/2023", "Fraction of a cent", "$12.345", "", "$100.00", "Food", "Groceries"],
+    ])
+    with pytest.raises(Exception, match="whole cents"):
+        parse_monthly_statement(statement)
+
+
+def test_statement_names():
+    # the README's "_" form, the "-" form, no account and an account made of digits all parse to the same month
+    for name, account in [("SpendAccountABC_2023-02.csv", "ABC"), ("SpendAccountABC-2023-02.csv", "ABC"),
+                          ("SpendAccount2023-02.csv", ""), ("SpendAccount_2023-02.csv", ""),
+                          ("SpendAccount1234-2023-02.csv", "1234"), ("SpendAccount1234_2023-02.csv", "1234"),
+                          ("SpendAccountX01-2023-02.csv", "X01")]:
+        assert parse_statement_account("./post-categorise/" + name) == account, name
+        assert parse_monthly_statement_date("./post-categorise/" + name).strftime("%Y-%m-%d") == "2023-02-28", name
+    for name in ["SpendAccountABC_2023-2.csv", "SpendAccountABC_2023-02.csv.partial", "Account_2023-02.csv"]:
+        with pytest.raises(Exception, match="SpendAccount<account>_YYYY-MM.csv"):
+            parse_statement_account(name)
@@ -0,0 +1,33 @@
+from categorisation_cache import normalise_description
+
+
+# the cache is an exact lookup on the normalised description so different merchants must never share a key, while
+# the same merchant with different dates, card numbers or references must
+
+def test_merchant_text_is_kept_distinct():
+    distinct = [
+        ("WOOLWORTHS 1 MARKET ST", "WOOLWORTHS 2 GEORGE ST"),
+        ("BUNNINGS 3 DECOR AVE", "BUNNINGS 5 MAIN AVE"),
+        ("B2B4YOU DEPOSIT", "SALARY DEPOSIT"),
+        ("JUNE'S CAFE", "JULY'S CAFE"),
+        ("7-ELEVEN 2 MAYFAIR RD", "7-ELEVEN 2 OCEAN RD"),
+    ]
+    for first, second in distinct:
+        assert normalise_description(first) != normalise_description(second), (first, second)
+    assert normalise_description("WOOLWORTHS 1 MARKET ST") == "WOOLWORTHS 1 MARKET ST"
+    assert normalise_description("BUNNINGS 3 DECOR AVE") == "BUNNINGS 3 DECOR AVE"
+    assert normalise_description("B2B4YOU DEPOSIT") == "B2B4YOU DEPOSIT"
+
+
+def test_noise_is_merged():
+    merged = [
+        ("WOOLWORTHS 1234 SYDNEY 12/03", "Woolworths 5678 Sydney 01/04/2023"),
+        ("NETFLIX.COM 12 MAR 2023", "NETFLIX.COM 3 APRIL"),
+        ("NETFLIX.COM 12MAR23", "NETFLIX.COM 1 SEPT 23"),
+        ("KMART HOBART Card xx2029 Value Date: 01/01/2020", "KMART HOBART Card xx0373 Value Date: 15/02/2020"),
+        ("UBER TRIP REF 8AB3C9 10:42", "UBER TRIP REF 91ZZ20 18:05:11"),
+        ("PAYPAL 4564 **** **** 1234 TXN123456", "PAYPAL XXXX9876 INV A12345"),
+        ("SPOTIFY P1A2B3C4D5", "SPOTIFY 9Z8Y7X6W5"),
+    ]
+    for first, second in merged:
+        assert normalise_description(first) == normalise_description(second), (first, second)
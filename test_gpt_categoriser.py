@@ -0,0 +1,86 @@
+import os
+
+import pytest
+
+import gpt_categoriser
+from gpt_categoriser import align_compact_response, align_response, rebuild_categorised_statement
+
+# responses are matched back to statement rows, anything that cannot be matched is None so the row is re-requested
+
+BUDGET_CATEGORIES = {("Food", "Groceries"), ("Food", "Takeaway"), ("Bills", "Power")}
+CATEGORY_IDS = {"1": ("Food", "Groceries"), "2": ("Food", "Takeaway"), "3": ("Bills", "Power")}
+STATEMENT_ROWS = ["WOOLWORTHS SYDNEY,12.00,", "UBER EATS,30.50,", "AGL ENERGY,120.00,"]
+
+
+def test_aligns_every_row():
+    response = "WOOLWORTHS SYDNEY,12.00,,Food,Groceries\nUBER EATS,30.50,,Food,Takeaway\nAGL ENERGY,120.00,,Bills,Power"
+    assert align_response(response, STATEMENT_ROWS, BUDGET_CATEGORIES) == \
+        [("Food", "Groceries"), ("Food", "Takeaway"), ("Bills", "Power")]
+
+
+def test_blank_lines_and_header_echo_are_skipped():
+    response = "\n\nDescription,Debit,Credit,Category,Sub-Category\nWOOLWORTHS SYDNEY,12.00,,Food,Groceries\n\n" \
+               "UBER EATS,30.50,, Food , \"Takeaway\"\n  \nAGL ENERGY,120.00,,Bills,Power\n"
+    assert align_response(response, STATEMENT_ROWS, BUDGET_CATEGORIES) == \
+        [("Food", "Groceries"), ("Food", "Takeaway"), ("Bills", "Power")]
+
+
+def test_dropped_row_only_affects_that_row():
+    response = "WOOLWORTHS SYDNEY,12.00,,Food,Groceries\nAGL ENERGY,120.00,,Bills,Power"
+    assert align_response(response, STATEMENT_ROWS, BUDGET_CATEGORIES) == \
+        [("Food", "Groceries"), None, ("Bills", "Power")]
+
+
+def test_invalid_pair_only_affects_that_row():
+    response = "WOOLWORTHS SYDNEY,12.00,,Food,Not A Category\nUBER EATS,30.50,,Food,Takeaway,extra\n" \
+               "AGL ENERGY,120.00,,Bills,Power"
+    assert align_response(response, STATEMENT_ROWS, BUDGET_CATEGORIES) == [None, None, ("Bills", "Power")]
+
+
+def test_comma_inside_description():
+    statement_rows = ["SHOP, SYDNEY,12.00,", "SHOP,5.00,"]
+    response = "SHOP, SYDNEY,12.00,,Food,Groceries\nSHOP,5.00,,Food,Takeaway"
+    assert align_response(response, statement_rows, BUDGET_CATEGORIES) == \
+        [("Food", "Groceries"), ("Food", "Takeaway")]
+
+
+def test_duplicate_rows_are_aligned_in_order():
+    statement_rows = ["UBER EATS,30.50,", "UBER EATS,30.50,", "AGL ENERGY,120.00,"]
+    response = "UBER EATS,30.50,,Food,Takeaway\nUBER EATS,30.50,,Food,Groceries\nAGL ENERGY,120.00,,Bills,Power"
+    assert align_response(response, statement_rows, BUDGET_CATEGORIES) == \
+        [("Food", "Takeaway"), ("Food", "Groceries"), ("Bills", "Power")]
+    # a duplicate answered once leaves the second copy to be re-requested
+    response = "UBER EATS,30.50,,Food,Takeaway\nAGL ENERGY,120.00,,Bills,Power"
+    assert align_response(response, statement_rows, BUDGET_CATEGORIES) == \
+        [("Food", "Takeaway"), None, ("Bills", "Power")]
+
+
+def test_compact_response():
+    response = "\nRow,Id\n1,1\n\n2, \"2\"\n3,3\n"
+    assert align_compact_response(response, 3, CATEGORY_IDS) == \
+        [("Food", "Groceries"), ("Food", "Takeaway"), ("Bills", "Power")]
+
+
+def test_compact_out_of_range_duplicate_and_invalid_ids():
+    response = "0,1\n4,1\n1,2\n1,3\n2,9\n2,x,1\nthree,3"
+    assert align_compact_response(response, 3, CATEGORY_IDS) == [("Food", "Takeaway"), None, None]
+
+
+def test_rebuild_rejects_mismatched_pairs(tmp_path, monkeypatch):
+    pre_categorise_dir = str(tmp_path / "pre") + "/"
+    post_categorise_dir = str(tmp_path / "post") + "/"
+    os.makedirs(pre_categorise_dir)
+    os.makedirs(post_categorise_dir)
+    monkeypatch.setattr(gpt_categoriser, "EXPENSES_STATEMENT_PRE_CATEGORISE_DIR", pre_categorise_dir)
+    monkeypatch.setattr(gpt_categoriser, "EXPENSES_STATEMENT_POST_CATEGORISE_DIR", post_categorise_dir)
+    statement_file = pre_categorise_dir + "SpendAccount_2023-02.csv"
+    with open(statement_file, "w") as file:
+        file.write("Date,Description,Debit,Credit,Balance\n01/02/2023,UBER EATS,30.50,,100.00\n"
+                   "02/02/2023,AGL ENERGY,120.00,,-20.00\n")
+    for category_pairs in [[("Food", "Takeaway")], [("Food", "Takeaway"), ("Bills", "Power"), ("Bills", "Power")]]:
+        with pytest.raises(Exception):
+            rebuild_categorised_statement(iter(category_pairs), statement_file)
+        assert os.listdir(post_categorise_dir) == []
+    categorised_file = rebuild_categorised_statement(iter([("Food", "Takeaway"), ("Bills", "Power")]), statement_file)
+    with open(categorised_file) as file:
+        assert file.read().splitlines()[-1] == "02/02/2023,AGL ENERGY,120.00,,-20.00,Bills,Power"
@@ -0,0 +1,87 @@
+import random
+
+from stockholm import Money
+
+from calculator import compute_carry, compute_remainder, compute_remaining_spend, \
+    compute_next_month_available_budget
+from ledger import compute_months, money_to_cents
+
+
+# compute_months must match the calculator.py chain run month by month to the cent, including the carry restart
+# when a budget drops a pair and later adds it back and resuming from a checkpointed remainder
+
+def aud(cents: int) -> Money:
+    return Money.from_sub_units(cents, "AUD")
+
+
+def category_total_cents(parsed_dict: dict, category: str) -> int:
+    return sum(map(money_to_cents, parsed_dict.get(category, {}).values()))
+
+
+def compute_months_iteratively(parsed_budgets: list[dict], parsed_statements: list[dict],
+                               remainder: dict = None) -> list[tuple]:
+    months = []
+    for parsed_budget, parsed_statement in zip(parsed_budgets, parsed_statements):
+        carry = compute_carry(remainder, parsed_budget)
+        # pairs the previous month did not budget for start again from a zero carry
+        padded_carry = {category: {sub_category: carry.get(category, {}).get(sub_category, aud(0))
+                                   for sub_category in parsed_budget[category]} for category in parsed_budget}
+        remainder = compute_remainder(padded_carry, parsed_budget, parsed_statement)
+        remaining_spend = compute_remaining_spend(padded_carry, parsed_budget)
+        next_month_available = compute_next_month_available_budget(remainder, parsed_budget)
+        category_totals = {category: [category_total_cents(parsed_dict, category) for parsed_dict in
+                                      [parsed_budget, carry, remaining_spend, parsed_statement, remainder,
+                                       next_month_available]] for category in parsed_budget}
+        months.append((carry, remainder, remaining_spend, next_month_available, category_totals))
+    return months
+
+
+def random_months(seed: int, month_count: int) -> tuple[list[dict], list[dict]]:
+    # budgets drop and re-add pairs and whole categories, statements also spend in pairs no budget has
+    generator = random.Random(seed)
+    pairs = [("Category{}".format(category), "Sub{}".format(sub_category))
+             for category in range(4) for sub_category in range(3)]
+    parsed_budgets = []
+    parsed_statements = []
+    for _ in range(month_count):
+        parsed_budget = {}
+        for category, sub_category in pairs:
+            if generator.random() < 0.8:
+                parsed_budget.setdefault(category, {})[sub_category] = aud(generator.randrange(0, 50000, 100))
+        parsed_statement = {}
+        for category, sub_category in pairs + [("Category0", "Unbudgeted"), ("Other", "Other")]:
+            if generator.random() < 0.7:
+                parsed_statement.setdefault(category, {})[sub_category] = aud(generator.randrange(-2000, 60000))
+        parsed_budgets.append(parsed_budget)
+        parsed_statements.append(parsed_statement)
+    return parsed_budgets, parsed_statements
+
+
+def test_drop_and_re_add_restarts_carry():
+    budget = {"Food": {"Groceries": aud(50000), "Takeaway": aud(10000)}}
+    dropped = {"Food": {"Groceries": aud(50000)}}
+    statement = {"Food": {"Groceries": aud(65000), "Takeaway": aud(12000)}}
+    parsed_budgets = [budget, dropped, budget]
+    parsed_statements = [statement, statement, statement]
+    computed_months = compute_months(parsed_budgets, parsed_statements)
+    assert computed_months == compute_months_iteratively(parsed_budgets, parsed_statements)
+    # Takeaway was not budgeted in the second month so the third starts again from zero
+    assert computed_months[2][0]["Food"] == {"Groceries": aud(-30000)}
+    assert computed_months[2][1]["Food"]["Takeaway"] == aud(-2000)
+
+
+def test_matches_calculator():
+    for seed in range(50):
+        parsed_budgets, parsed_statements = random_months(seed, 12)
+        assert compute_months(parsed_budgets, parsed_statements) == \
+            compute_months_iteratively(parsed_budgets, parsed_statements), seed
+
+
+def test_resume_from_initial_remainder():
+    for seed in range(50):
+        parsed_budgets, parsed_statements = random_months(seed, 12)
+        expected = compute_months_iteratively(parsed_budgets, parsed_statements)
+        for resume_month in range(1, 12):
+            initial_remainder = expected[resume_month - 1][1]
+            assert compute_months(parsed_budgets[resume_month:], parsed_statements[resume_month:],
+                                  initial_remainder) == expected[resume_month:], (seed, resume_month)
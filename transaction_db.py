@@ -0,0 +1,153 @@
+import csv
+import sqlite3
+
+from budget_parser import parse_monthly_budget_date, parse_monthly_statement_date, statement_column_indices, \
+    statement_row_amount
+from ledger import cents_to_money
+from metrics import logger, metrics
+from report_checkpoints import file_digest
+
+SCHEMA: str = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    month TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    file TEXT NOT NULL REFERENCES files (path) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    month TEXT NOT NULL,
+    date TEXT NOT NULL,
+    description TEXT NOT NULL,
+    category TEXT NOT NULL,
+    sub_category TEXT NOT NULL,
+    amount_cents INTEGER NOT NULL,
+    PRIMARY KEY (file, position)
+);
+CREATE INDEX IF NOT EXISTS transactions_month_category ON transactions (month, category, sub_category);
+CREATE INDEX IF NOT EXISTS transactions_category_month ON transactions (category, sub_category, month);
+CREATE TABLE IF NOT EXISTS budget_rows (
+    file TEXT NOT NULL REFERENCES files (path) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    category TEXT NOT NULL,
+    sub_category TEXT NOT NULL,
+    budget_cents INTEGER NOT NULL,
+    ignored INTEGER NOT NULL,
+    PRIMARY KEY (file, position)
+);
+"""
+
+
+class TransactionDatabase:
+    # SQLite ledger of categorised statement rows and budget rows so history can be aggregated with indexed queries
+    # instead of re-reading every CSV. Files are keyed by path and only reloaded when their digest changes, months
+    # are YYYY-MM strings. Statement rows are stored with the amount the report counts, rows it skips are left out
+    def __init__(self, database_file: str):
+        self.connection = sqlite3.connect(database_file)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def stored_digest(self, path: str) -> str:
+        row = self.connection.execute("SELECT digest FROM files WHERE path = ?", (path,)).fetchone()
+        return None if row is None else row[0]
+
+    def replace_file(self, path: str, kind: str, digest: str, month: str) -> None:
+        # deleting the file cascades to its rows so a changed file never leaves stale rows behind
+        self.connection.execute("DELETE FROM files WHERE path = ?", (path,))
+        self.connection.execute("INSERT INTO files (path, kind, digest, month) VALUES (?, ?, ?, ?)",
+                                (path, kind, digest, month))
+
+    def ingest_statement(self, statement: str) -> bool:
+        # returns whether the statement was (re)loaded
+        digest = file_digest(statement)
+        if self.stored_digest(statement) == digest:
+            return False
+        month = parse_monthly_statement_date(statement).strftime("%Y-%m")
+        transactions = []
+        with open(statement) as file:
+            reader = csv.reader(file)
+            header_row = next(reader)
+            column_indices = statement_column_indices(header_row)
+            date_index = header_row.index("Date")
+            description_index = header_row.index("Description")
+            for position, row in enumerate(reader):
+                amount = statement_row_amount(row, column_indices)
+                if amount is not None:
+                    transactions.append((statement, position, month, row[date_index], row[description_index])
+                                        + amount)
+        with self.connection:
+            self.replace_file(statement, "statement", digest, month)
+            self.connection.executemany("INSERT INTO transactions (file, position, month, date, description, "
+                                        "category, sub_category, amount_cents) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                        transactions)
+        metrics.increment("rows_ingested", len(transactions))
+        return True
+
+    def ingest_budget(self, budget: str) -> bool:
+        # returns whether the budget was (re)loaded
+        digest = file_digest(budget)
+        if self.stored_digest(budget) == digest:
+            return False
+        with open(budget) as file:
+            reader = csv.reader(file)
+            header_row = next(reader)
+            category_index = header_row.index("Category")
+            sub_category_index = header_row.index("Sub-Category")
+            budget_index = header_row.index("Budget")
+            ignore_index = header_row.index("Ignore")
+            budget_rows = [(budget, position, row[category_index], row[sub_category_index],
+                            int(row[budget_index]) * 100, row[ignore_index] == "1")
+                           for position, row in enumerate(reader)]
+        with self.connection:
+            self.replace_file(budget, "budget", digest, parse_monthly_budget_date(budget).strftime("%Y-%m"))
+            self.connection.executemany("INSERT INTO budget_rows (file, position, category, sub_category, "
+                                        "budget_cents, ignored) VALUES (?, ?, ?, ?, ?, ?)", budget_rows)
+        return True
+
+    def sync(self, budgets: list[str], statements: list[str]) -> None:
+        # makes the database match the given files, new or changed files are loaded and missing ones removed
+        with metrics.stage("sync_database"):
+            loaded = sum(map(self.ingest_budget, budgets)) + sum(map(self.ingest_statement, statements))
+            current = set(budgets) | set(statements)
+            removed = [path for path, in self.connection.execute("SELECT path FROM files")
+                       if path not in current]
+            with self.connection:
+                self.connection.executemany("DELETE FROM files WHERE path = ?", [(path,) for path in removed])
+        logger.info("database: %d files loaded, %d removed", loaded, len(removed))
+
+    def budget(self, budget: str) -> dict:
+        # same shape as ParsedBudget.as_dict, categories with only ignored rows are kept empty
+        parsed_budget = {}
+        for category, sub_category, budget_cents, ignored in self.connection.execute(
+                "SELECT category, sub_category, budget_cents, ignored FROM budget_rows WHERE file = ? "
+                "ORDER BY position", (budget,)):
+            if category not in parsed_budget:
+                parsed_budget[category] = {}
+            if not ignored:
+                parsed_budget[category][sub_category] = cents_to_money(budget_cents)
+        return parsed_budget
+
+    def monthly_statements(self, from_month: str = None, to_month: str = None) -> dict[str, dict]:
+        # spend per month in the same shape as parse_monthly_statement, every statement for a month is combined
+        parsed_statements = {}
+        for month, category, sub_category, total_cents in self.connection.execute(
+                "SELECT month, category, sub_category, SUM(amount_cents) FROM transactions "
+                "WHERE month >= ? AND month <= ? GROUP BY month, category, sub_category "
+                "ORDER BY month, MIN(rowid)", (from_month or "", to_month or "9999-99")):
+            parsed_statement = parsed_statements.setdefault(month, {})
+            parsed_statement.setdefault(category, {})[sub_category] = cents_to_money(total_cents)
+        return parsed_statements
+
+    def spend_by_month(self, category: str, sub_category: str = None, from_month: str = None,
+                       to_month: str = None) -> dict[str, int]:
+        # total cents per month for a category, or one of its sub-categories, over a range of months
+        query = "SELECT month, SUM(amount_cents) FROM transactions WHERE category = ? AND month >= ? AND month <= ?"
+        parameters = [category, from_month or "", to_month or "9999-99"]
+        if sub_category is not None:
+            query = query + " AND sub_category = ?"
+            parameters.append(sub_category)
+        return dict(self.connection.execute(query + " GROUP BY month ORDER BY month", parameters).fetchall())
@@ -0,0 +1,62 @@
+import glob
+import os
+import time
+
+
+class DirectoryWatcher:
+    # Polls glob patterns for new or modified files, a file is only reported once its size and modification time
+    # have stopped changing for settle_seconds so partially written statements are never picked up
+    def __init__(self, patterns: list[str], settle_seconds: float = 2):
+        self.patterns = patterns
+        self.settle_seconds = settle_seconds
+        self.processed = {}
+        self.pending = {}
+
+    def signatures(self) -> dict[str, tuple[int, int]]:
+        signatures = {}
+        for pattern in self.patterns:
+            for path in glob.glob(pattern):
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                signatures[path] = (stat.st_mtime_ns, stat.st_size)
+        return signatures
+
+    def poll(self) -> list[str]:
+        now = time.monotonic()
+        ready = []
+        current = self.signatures()
+        for path, signature in current.items():
+            if self.processed.get(path) == signature:
+                self.pending.pop(path, None)
+                continue
+            pending_signature, changed_at = self.pending.get(path, (None, None))
+            if pending_signature != signature:
+                self.pending[path] = (signature, now)
+            elif now - changed_at >= self.settle_seconds:
+                ready.append(path)
+        for path in list(self.pending):
+            if path not in current:
+                del self.pending[path]
+        return sorted(ready)
+
+    def mark_processed(self, paths: list[str] = None, signatures: dict[str, tuple[int, int]] = None) -> None:
+        # with no paths every file currently matching is treated as processed, signatures are the ones the files
+        # were read with and default to their current ones
+        current = self.signatures() if signatures is None else signatures
+        for path in current if paths is None else paths:
+            if path in current:
+                self.processed[path] = current[path]
+            self.pending.pop(path, None)
+
+    def settled(self, ready: list[str]) -> dict[str, tuple[int, int]]:
+        # the files a run for ready may read with their signatures: ready files still as they were polled and files
+        # unchanged since they were processed, anything still being written or created since the poll waits for a
+        # later run
+        settled = {}
+        for path, signature in self.signatures().items():
+            if self.processed.get(path) == signature or \
+                    (path in ready and self.pending.get(path, (None, None))[0] == signature):
+                settled[path] = signature
+        return settled